@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+
+#############################################################################################
+# Copyright Institut Curie 2022                                                             #
+#                                                                                           #
+# This software is a computer program whose purpose                                         #
+# is to analyze high-throughput sequencing data.                                            #
+# You can use, modify and/ or redistribute the software under                               #
+# the terms of license (see the LICENSE file for more details).                             #
+# The software is distributed in the hope that it will be useful,                           #
+# but "AS IS" WITHOUT ANY WARRANTY OF ANY KIND.                                             #
+# Users are therefore encouraged to test the software's suitabilityas regards               #
+# their requirements in conditions enabling the security of their systems and/or data.      #
+# The fact that you are presently reading this means that                                   #
+# you have had knowledge of the license and that you accept its terms.                      #
+#############################################################################################
+
+"""
+Detect the 3' adapter of a sample from the first reads of its fastq files.
+All k-mers of the known adapters (fasta file) are stored in a sorted table, and
+the k-mers of the reads are looked up in this table by batches of reads, so that
+the memory used does not depend on the number of reads scanned.
+Adapters are ranked by the number of reads containing their first k-mer (the
+start of an adapter read-through), then by the number of their other k-mers seen
+in the reads. The sequence to trim is the part of the best adapter supported by
+the reads, extended from its first k-mer, and preceded by the base found before it in
+most reads (ie. the 'A' of the A-tailing, missing from the TruSeq adapters of the fasta file).
+"""
+
+import gzip
+import argparse
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+
+KMER_SIZE = 12
+N_READS = 200000
+## Number of reads encoded at once, which bounds the size of the temporary arrays
+BATCH_READS = 10000
+MIN_PERCENT = 0.1
+TOP_ADAPTERS = 10
+## An adapter k-mer is supported if it is found in this fraction of the reads with the first k-mer
+MIN_SUPPORT = 0.5
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for i, base in enumerate("ACGT"):
+    BASE_CODES[ord(base)] = BASE_CODES[ord(base.lower())] = i
+
+HEADER = ["Sample_id", "Read", "Rank", "Adapter", "Number_reads", "Percent_reads", "Kmer_support", "Trim_sequence", "Sequence"]
+
+
+def get_options():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help="Input R1 fastq file", required=True)
+    parser.add_argument("-I", "--input2", help="Input R2 fastq file", default=None)
+    parser.add_argument("-a", "--adapters", help="Fasta file of the known adapters", required=True)
+    parser.add_argument("-s", "--sample_name", help="Sample name", default="")
+    parser.add_argument("-o", "--output", help="Output file (ranked adapters)", default=None)
+    parser.add_argument("-n", "--n_reads", type=int, default=N_READS, help="Number of reads to scan")
+    parser.add_argument("-k", "--kmer_size", type=int, default=KMER_SIZE, help="k-mer size (max 31)")
+    parser.add_argument("--min_percent", type=float, default=MIN_PERCENT,
+                        help="Minimum percentage of reads with the adapter to select it")
+    parser.add_argument("--top", type=int, default=TOP_ADAPTERS, help="Number of adapters reported per read")
+    args = parser.parse_args()
+    return(args)
+
+
+def load_adapters(fasta):
+    """
+    Adapters as an ordered dict {sequence: name}. Sequences listed several times keep their first name.
+    """
+    adapters = OrderedDict()
+    name = None
+    with open(fasta) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('>'):
+                name = line[1:].split()[0]
+            elif name is not None:
+                adapters.setdefault(line.upper(), name)
+                name = None
+    return adapters
+
+
+def open_fastq(path):
+    """
+    Opened (decompressed) fastq file. Gzip compression is detected from the magic number,
+    not from the extension.
+    """
+    raw = open(path, 'rb')
+    if raw.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    return raw
+
+
+def read_sequences(path, n_reads):
+    """
+    Sequences of the first n_reads reads
+    """
+    seqs = []
+    with open_fastq(path) as f:
+        for i, line in enumerate(f):
+            if i % 4 == 1:
+                seqs.append(line.rstrip())
+                if len(seqs) >= n_reads:
+                    break
+    return seqs
+
+
+def batches(seqs, size=BATCH_READS):
+    """
+    Sequences joined in buffers of at most size reads, one per line
+    """
+    it = iter(seqs)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            break
+        yield b'\n'.join(batch) + b'\n'
+
+
+def encode_kmers(seq, k):
+    """
+    2 bits encoded k-mers at each position of a sequence buffer, with the index of the line
+    of each k-mer. k-mers with other characters than A, C, G, T (including newlines) are dropped.
+    """
+    buf = np.frombuffer(seq, dtype=np.uint8)
+    codes = BASE_CODES[buf]
+    n = codes.size - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    kmers = np.zeros(n, dtype=np.int64)
+    for i in range(k):
+        kmers = (kmers << 2) | (codes[i:i + n] & 3)
+    invalid = np.concatenate(([0], np.cumsum(codes > 3)))
+    valid = invalid[k:] - invalid[:n] == 0
+    lines = np.cumsum(buf == ord('\n'))[:n] - (buf[:n] == ord('\n'))
+    return kmers[valid], lines[valid]
+
+
+class AdapterIndex(object):
+    """
+    Sorted table of the k-mers of all adapters
+    """
+
+    def __init__(self, adapters, k=KMER_SIZE):
+        self.k = k
+        self.adapters = adapters
+        self.kmers = [encode_kmers(seq.encode('ascii'), k)[0] for seq in adapters]
+        self.table = np.unique(np.concatenate(self.kmers)) if self.kmers else np.zeros(0, dtype=np.int64)
+
+    def count_reads(self, seqs, batch_reads=BATCH_READS):
+        """
+        Number of reads containing each k-mer of the table
+        """
+        counts = np.zeros(self.table.size, dtype=np.int64)
+        if self.table.size == 0:
+            return counts
+        for seq in batches(seqs, batch_reads):
+            kmers, lines = encode_kmers(seq, self.k)
+            pos = np.clip(np.searchsorted(self.table, kmers), 0, self.table.size - 1)
+            hit = self.table[pos] == kmers
+            ## count each (read, k-mer) pair once, reads do not span batches
+            pairs = np.unique(lines[hit] * self.table.size + pos[hit])
+            counts += np.bincount(pairs % self.table.size, minlength=self.table.size)
+        return counts
+
+    def rank(self, seqs, min_percent=MIN_PERCENT):
+        """
+        Ranked adapters, as a list of ordered dicts. The sequence to trim is only set
+        for the first adapter, if it is found in more than min_percent of the reads.
+        """
+        n_reads = len(seqs)
+        counts = self.count_reads(seqs)
+        rows = []
+        for (adapter, name), kmers in zip(self.adapters.items(), self.kmers):
+            if kmers.size == 0:
+                continue
+            kcounts = counts[np.searchsorted(self.table, kmers)]
+            rows.append(OrderedDict([("Adapter", name), ("Number_reads", int(kcounts[0])),
+                                     ("Percent_reads", 100. * kcounts[0] / n_reads if n_reads else 0.),
+                                     ("Kmer_support", int(kcounts.sum())), ("Trim_sequence", "NA"),
+                                     ("Sequence", adapter), ("kcounts", kcounts)]))
+        rows.sort(key=lambda r: (-r["Number_reads"], -r["Kmer_support"]))
+        if rows and rows[0]["Number_reads"] > 0 and rows[0]["Percent_reads"] >= min_percent:
+            trim = self.supported_sequence(rows[0]["Sequence"], rows[0]["kcounts"])
+            rows[0]["Trim_sequence"] = leading_base(seqs, trim[:self.k]) + trim
+        for i, row in enumerate(rows):
+            row["Rank"] = i + 1
+            del row["kcounts"]
+        return rows
+
+    def supported_sequence(self, adapter, kcounts):
+        """
+        Start of the adapter, as long as its k-mers are found in the reads containing the first one
+        """
+        n = 1
+        while n < kcounts.size and kcounts[n] >= MIN_SUPPORT * kcounts[0]:
+            n += 1
+        return adapter[:n + self.k - 1]
+
+
+def leading_base(seqs, start):
+    """
+    Base found before the start of the adapter in at least MIN_SUPPORT of the reads
+    containing it, or an empty string
+    """
+    start = start.encode('ascii')
+    counts = {}
+    n = 0
+    for seq in seqs:
+        i = seq.find(start)
+        if i > 0:
+            base = seq[i - 1:i].upper()
+            counts[base] = counts.get(base, 0) + 1
+            n += 1
+    if not counts:
+        return ''
+    base, count = max(counts.items(), key=lambda item: item[1])
+    return base.decode('ascii') if count >= MIN_SUPPORT * n and base in (b'A', b'C', b'G', b'T') else ''
+
+
+def write_table(rows_by_read, sample, output, top=TOP_ADAPTERS):
+    out = open(output, 'w') if output else None
+    try:
+        lines = ["\t".join(HEADER)]
+        for read, rows in rows_by_read.items():
+            for row in rows[:top]:
+                values = dict(row, Sample_id=sample, Read=read, Percent_reads="{:.2f}".format(row["Percent_reads"]))
+                lines.append("\t".join(str(values[col]) for col in HEADER))
+        if out is not None:
+            out.write("\n".join(lines) + "\n")
+        else:
+            print("\n".join(lines))
+    finally:
+        if out is not None:
+            out.close()
+
+
+if __name__ == '__main__':
+    args = get_options()
+
+    index = AdapterIndex(load_adapters(args.adapters), k=args.kmer_size)
+    inputs = OrderedDict([("R1", args.input)])
+    if args.input2:
+        inputs["R2"] = args.input2
+
+    rows_by_read = OrderedDict()
+    for read, path in inputs.items():
+        seqs = read_sequences(path, args.n_reads)
+        rows_by_read[read] = index.rank(seqs, min_percent=args.min_percent)
+
+    write_table(rows_by_read, args.sample_name, args.output, top=args.top)
@@ -0,0 +1,1130 @@
+#!/usr/bin/env python
+
+
+#############################################################################################
+# Copyright Institut Curie 2022                                                             #
+#                                                                                           #
+# This software is a computer program whose purpose                                         #
+# is to analyze high-throughput sequencing data.                                            #
+# You can use, modify and/ or redistribute the software under                               #
+# the terms of license (see the LICENSE file for more details).                             #
+# The software is distributed in the hope that it will be useful,                           #
+# but "AS IS" WITHOUT ANY WARRANTY OF ANY KIND.                                             #
+# Users are therefore encouraged to test the software's suitabilityas regards               #
+# their requirements in conditions enabling the security of their systems and/or data.      #
+# The fact that you are presently reading this means that                                   #
+# you have had knowledge of the license and that you accept its terms.                      #
+#############################################################################################
+
+"""
+Compute reads and trimming statistics from raw/trimmed fastq files.
+Each fastq file is decompressed and read only once, by chunks of bytes.
+Optionally (--qc), per base quality, per base sequence content and GC content
+are computed in the same pass, as a lightweight alternative to FastQC.
+The library complexity (--complexity) is estimated from the raw reads, or pairs
+of reads, with fixed-size sketches (see sketches.py).
+For very large files, the statistics can be computed on a subset of the reads
+(--sample_fraction, --max_reads). BGZF files are only read at the sampled blocks, and
+other files are read up to the last sampled block. The number of reads is estimated
+from the compressed size when the whole file is not read, and the other values are
+reported with their 95% confidence interval.
+Results can be stored in a persistent cache (--cache, see qc_cache.py), so that
+files already seen are not read again.
+With --fragment, the general metrics and the per sequence quality counts are also
+saved in a JSON fragment ('<sample>.general.fragment.json'), merged by stats2multiqc.py.
+When the RAWQC_PERF environment variable is set, the time, throughput and memory of
+the reading and writing stages are saved in '<sample>.fastq_metrics.perf.json'.
+With --split, large BGZF or indexed gzip files are split in several parts read
+in parallel (see gzip_index.py). Each part starts at the first fastq record after
+its offset, and the statistics of the parts are merged. The files used for the library
+complexity are never split, as the sketches of several parts can not be merged exactly.
+Gzip indexes are only built with --index_dir, a directory kept between runs.
+"""
+
+import os
+import sys
+import math
+import gzip
+import json
+import argparse
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+import sketches
+import gzip_index
+from perf_stats import PerfRecorder, file_size
+from sketches import PREFIX_LENGTH, ComplexitySketch, hash_prefixes, hash_pairs
+from qc_cache import ResultCache, source_version
+
+CHUNK_SIZE = 4 * 1024 * 1024
+## Blocks of the sampled reads, small so that the confidence intervals rely on many of them
+SAMPLE_CHUNK_SIZE = 256 * 1024
+## Compressed size of the sampled parts of BGZF files (about SAMPLE_CHUNK_SIZE once decompressed)
+SAMPLE_PART_SIZE = 64 * 1024
+MIN_SPLIT_SIZE = 256 * 1024 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+NEWLINE = ord('\n')
+CARRIAGE_RETURN = ord('\r')
+PHRED_OFFSET = 33
+MAX_QUAL = 93
+N_QUALS = MAX_QUAL + 1
+
+## A, C, G, T and N (any other character) codes, null characters (padding) are not counted
+BASES = "ACGTN"
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for i, base in enumerate(BASES[:4]):
+    BASE_CODES[ord(base)] = BASE_CODES[ord(base.lower())] = i
+BASE_CODES[0] = len(BASES)
+QUAL_CODES = np.clip(np.arange(256) - PHRED_OFFSET, 0, MAX_QUAL)
+QUAL_CODES[0] = N_QUALS
+GC_BINS = 101
+QUANTILES = OrderedDict([("P10", 0.1), ("Q1", 0.25), ("Median", 0.5), ("Q3", 0.75), ("P90", 0.9)])
+
+HEADER = ["Sample_id", "Number_of_frag", "Mean_length", "Total_base", "Trimmed_Mean_length",
+          "Number_trimmed", "Percent_trimmed", "Number_discarded", "Percent_discarded"]
+COMPLEXITY_HEADER = ["Distinct_frag", "Percent_duplicates", "Percent_duplicates_ci", "Max_duplication"]
+SAMPLING_HEADER = ["Sampled_frag", "Mean_length_ci", "Percent_trimmed_ci"]
+Z_95 = 1.96
+
+
+def get_options():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", required=True, help="Raw fastq file (R1)")
+    parser.add_argument("-I", "--input_r2", default=None, help="Raw fastq file (R2)")
+    parser.add_argument("-t", "--trimmed", default=None, help="Trimmed fastq file (R1)")
+    parser.add_argument("-T", "--trimmed_r2", default=None, help="Trimmed fastq file (R2)")
+    parser.add_argument("-s", "--sample", default=None, help="Sample name")
+    parser.add_argument("-o", "--output", default=None, help="Output file (default: stdout)")
+    parser.add_argument("-p", "--threads", type=int, default=1, help="Number of fastq files processed in parallel")
+    parser.add_argument("-q", "--seqqual", action="store_true",
+                        help="Write the per sequence quality scores of the trimmed (or raw) reads in <sample>[_R1|_R2]_seqqual.tsv")
+    parser.add_argument("--qc", action="store_true",
+                        help="Compute per base quality, per base sequence content and GC content of the raw and trimmed reads")
+    parser.add_argument("-c", "--complexity", action="store_true",
+                        help="Estimate the number of distinct raw fragments, and write the saturation curve in <sample>_saturation.tsv")
+    parser.add_argument("-f", "--sample_fraction", type=float, default=1.,
+                        help="Fraction of the reads used to compute the statistics. All reads are still counted.")
+    parser.add_argument("-m", "--max_reads", type=int, default=None,
+                        help="Maximum number of reads used to compute the statistics. The other reads are still counted.")
+    parser.add_argument("--cache", default=None, help="Directory of the persistent cache of results")
+    parser.add_argument("--cache_size", type=int, default=1024, help="Maximum size of the cache (MB)")
+    parser.add_argument("--no_cache", action="store_true", help="Do not use the cache")
+    parser.add_argument("--split", action="store_true",
+                        help="Split large BGZF or indexed gzip files across the threads. Gzip indexes are built if 'indexed_gzip' is available.")
+    parser.add_argument("--index_dir", default=None,
+                        help="Directory where the gzip indexes are built and kept between runs (default: no index is built, only the ones next to the fastq files are used)")
+    parser.add_argument("--fragment", action="store_true",
+                        help="Write the general metrics and per sequence quality counts in a JSON fragment for the MultiQC report")
+    args = parser.parse_args()
+    return(args)
+
+
+def prefetch(chunks, size=2):
+    """
+    Read the chunks in a background thread (decompression releases the GIL)
+    """
+    buffer = queue.Queue(maxsize=size)
+
+    def fill():
+        for chunk in chunks:
+            buffer.put(chunk)
+        buffer.put(None)
+
+    thread = threading.Thread(target=fill)
+    thread.daemon = True
+    thread.start()
+    while True:
+        chunk = buffer.get()
+        if chunk is None:
+            break
+        yield chunk
+
+
+def open_stream(raw):
+    """
+    Decompressed stream of an opened fastq file.
+    Gzip compression is detected from the magic number, not from the extension.
+    """
+    if raw.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    return raw
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    Yield the (decompressed) content of a fastq file by chunks of bytes.
+    """
+    with open(path, 'rb') as raw:
+        stream = open_stream(raw)
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def find_record_start(buf, begin=1):
+    """
+    Position of the first fastq record starting at a line start at or after 'begin':
+    a '@' line, followed by a sequence, a '+' line, and a quality of the same length.
+    Quality lines starting with '@' are rejected as the line after next is not a '+' line.
+    Return -1 if there is no candidate, None if more data is needed to check one.
+    """
+    i = max(begin, 1)
+    while True:
+        i = buf.find(b'\n@', i - 1)
+        if i < 0:
+            return -1
+        i += 1
+        ends = [buf.find(b'\n', i)]
+        for _ in range(3):
+            ends.append(buf.find(b'\n', ends[-1] + 1) if ends[-1] >= 0 else -1)
+        if ends[-1] < 0:
+            return None
+        seq = buf[ends[0] + 1:ends[1]].rstrip(b'\r')
+        qual = buf[ends[2] + 1:ends[3]].rstrip(b'\r')
+        if buf[ends[1] + 1:ends[1] + 2] == b'+' and len(seq) == len(qual):
+            return i
+        i += 1
+
+
+class PartReader(object):
+    """
+    Data of a part of a fastq file, from (chunk, in_range) pairs.
+    The part owns the records which start in ]start, end] (or [start, end] for
+    the first part), whatever the position of their end.
+    """
+
+    def __init__(self, chunks, first=True):
+        self.chunks = iter(chunks)
+        self.first = first
+        self.data = b''
+        self.offset = 0
+        self.end = None
+        self.eof = False
+
+    def fill(self):
+        chunk, in_range = next(self.chunks, (None, None))
+        if chunk is None:
+            self.eof = True
+            if self.end is None:
+                self.end = self.offset + len(self.data)
+            return
+        if not in_range and self.end is None:
+            self.end = self.offset + len(self.data)
+        self.data += chunk
+
+    def resync(self):
+        """
+        Drop the data before the first record of the part. Return False if the part has no record.
+        """
+        while True:
+            start = find_record_start(self.data)
+            if start is not None and start >= 0:
+                break
+            if self.eof or (start == -1 and self.end is not None and len(self.data) > self.end):
+                return False
+            self.fill()
+        if self.end is not None and start > self.end:
+            return False
+        self.data = self.data[start:]
+        self.offset = start
+        return True
+
+    def find_cut(self, n_lines):
+        """
+        Position in the data of the first record starting after the end of the part,
+        'n_lines' being the number of lines before the data
+        """
+        ends = np.flatnonzero(np.frombuffer(self.data, dtype=np.uint8) == NEWLINE)
+        index = n_lines + np.arange(1, ends.size + 1)
+        cuts = ends[(index % 4 == 0) & (self.offset + ends + 1 > self.end)]
+        return int(cuts[0]) + 1 if cuts.size > 0 else None
+
+    def records(self):
+        """
+        Yield the data of the records of the part
+        """
+        if not self.first and not self.resync():
+            return
+        n_lines = 0
+        while True:
+            if self.end is not None and self.data:
+                cut = self.find_cut(n_lines)
+                if cut is not None:
+                    yield self.data[:cut]
+                    return
+            if self.data:
+                yield self.data
+                n_lines += self.data.count(b'\n')
+                self.offset += len(self.data)
+                self.data = b''
+            if self.eof:
+                return
+            self.fill()
+
+
+def line_matrix(data, starts, lengths):
+    """
+    Characters of a set of lines as a (lines x cycles) matrix.
+    Rows are copied from a strided view of the buffer (one row per byte offset),
+    shorter lines are padded with null characters.
+    """
+    n_cycles = int(lengths.max())
+    if starts[-1] + n_cycles > data.size:
+        data = np.concatenate((data[starts[0]:], np.zeros(n_cycles, dtype=np.uint8)))
+        starts = starts - starts[0]
+    rows = as_strided(data, shape=(data.size - n_cycles + 1, n_cycles), strides=(data.strides[0],) * 2, writeable=False)
+    matrix = rows[starts]
+    if lengths.min() < n_cycles:
+        matrix[np.arange(n_cycles) >= lengths[:, None]] = 0
+    return matrix
+
+
+def add_rows(matrix, counts):
+    """
+    Add a (cycles x values) count matrix to another one, the number of cycles can differ
+    """
+    if counts.shape[0] > matrix.shape[0]:
+        counts[:matrix.shape[0]] += matrix
+        return counts
+    matrix[:counts.shape[0]] += counts
+    return matrix
+
+
+class FastqScanner(object):
+    """
+    Accumulate statistics over a fastq stream.
+    Only complete lines are processed ; the positions of the newline characters
+    give the line boundaries, and the line number gives the line type
+    (header, sequence, separator, quality).
+    With 'qc', count matrices (cycle x base, cycle x quality) and the GC content
+    distribution are also updated for each chunk. Their size only depends on the
+    read length.
+    With 'hashes', the hashes of the read prefixes are kept until they are
+    consumed by pop_hashes().
+    Skipped chunks are only used to count the lines. When the reads are sampled,
+    the length histogram of each sampled block is kept in 'blocks', to estimate
+    the confidence intervals from the variability between blocks.
+    """
+
+    def __init__(self, qc=False, hashes=False):
+        self.n_lines = 0
+        self.carry = b''
+        self.sketch = None
+        self.sampled = False
+        self.blocks = None
+        self.length_hist = np.zeros(0, dtype=np.int64)
+        self.qual_hist = np.zeros(N_QUALS, dtype=np.int64)
+        self.qc = qc
+        if qc:
+            self.base_counts = np.zeros((0, len(BASES)), dtype=np.int64)
+            self.cycle_qual_counts = np.zeros((0, N_QUALS), dtype=np.int64)
+            self.gc_hist = np.zeros(GC_BINS, dtype=np.int64)
+        self.hashes = [] if hashes else None
+
+    @property
+    def n_reads(self):
+        return self.n_lines // 4
+
+    @property
+    def n_sampled(self):
+        return int(self.length_hist.sum())
+
+    @property
+    def scale(self):
+        """
+        Ratio between the number of reads and the number of reads used for the statistics
+        """
+        n = self.n_sampled
+        return self.n_reads / n if n > 0 else 1.
+
+    @property
+    def total_bases(self):
+        return int(np.dot(np.arange(self.length_hist.size, dtype=np.int64), self.length_hist))
+
+    @property
+    def mean_length(self):
+        n = self.n_sampled
+        return self.total_bases / n if n > 0 else None
+
+    @property
+    def mean_length_ci(self):
+        """
+        Half width of the 95% confidence interval of the mean length.
+        The largest of the intervals estimated from the variance between reads
+        and from the variance between sampled blocks is returned.
+        """
+        n = self.n_sampled
+        if n < 2:
+            return None
+        lengths = np.arange(self.length_hist.size, dtype=np.float64)
+        var = np.dot((lengths - self.mean_length) ** 2, self.length_hist) / (n - 1)
+        ci = Z_95 * math.sqrt(var / n)
+        blocks = self.block_hists()
+        if blocks is not None:
+            block_ci = ratio_ci(np.dot(blocks, lengths[:blocks.shape[1]]), blocks.sum(axis=1))
+            if block_ci is not None:
+                ci = max(ci, block_ci)
+        return ci
+
+    def count_below_ci(self, threshold):
+        """
+        Half width of the 95% confidence interval of the fraction of sampled reads
+        shorter than threshold (see count_below), as for mean_length_ci
+        """
+        n = self.n_sampled
+        if n < 2:
+            return None
+        p = self.count_below(threshold) / float(n)
+        ci = Z_95 * math.sqrt(p * (1 - p) / n)
+        blocks = self.block_hists()
+        if blocks is not None:
+            upper = max(int(np.ceil(threshold)), 0)
+            block_ci = ratio_ci(blocks[:, :upper].sum(axis=1), blocks.sum(axis=1))
+            if block_ci is not None:
+                ci = max(ci, block_ci)
+        return ci
+
+    def block_hists(self):
+        """
+        Length histograms of the sampled blocks, as a (block x length) matrix
+        """
+        if not self.blocks:
+            return None
+        hists = np.zeros((len(self.blocks), max(b.size for b in self.blocks)), dtype=np.float64)
+        for i, b in enumerate(self.blocks):
+            hists[i, :b.size] = b
+        return hists
+
+    def scan(self, chunks):
+        for chunk in chunks:
+            self.feed(chunk)
+        return self.close()
+
+    def feed(self, chunk):
+        """
+        Process the complete lines of a chunk, and keep the last incomplete line
+        """
+        buf = self.carry + chunk if self.carry else chunk
+        ends = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == NEWLINE)
+        if ends.size == 0:
+            self.carry = buf
+            return
+        self.update(buf, ends)
+        self.carry = buf[ends[-1] + 1:]
+
+    def skip(self, chunk):
+        """
+        Only count the lines of a chunk
+        """
+        buf = self.carry + chunk if self.carry else chunk
+        last = buf.rfind(b'\n')
+        if last < 0:
+            self.carry = buf
+            return
+        self.n_lines += buf.count(b'\n')
+        self.carry = buf[last + 1:]
+
+    def close(self):
+        ## last line without newline character
+        if self.carry:
+            self.update(self.carry + b'\n', np.array([len(self.carry)]))
+            self.carry = b''
+        return self
+
+    def merge(self, other):
+        """
+        Add the statistics of another part of the file
+        """
+        self.n_lines += other.n_lines
+        self.length_hist = add_rows(self.length_hist, other.length_hist.copy())
+        self.qual_hist += other.qual_hist
+        if self.qc:
+            self.base_counts = add_rows(self.base_counts, other.base_counts.copy())
+            self.cycle_qual_counts = add_rows(self.cycle_qual_counts, other.cycle_qual_counts.copy())
+            self.gc_hist += other.gc_hist
+        if self.sketch is not None:
+            self.sketch.merge(other.sketch)
+        return self
+
+    def to_dict(self):
+        """
+        State of the scanner once closed, as numbers and numpy arrays (see qc_cache.py)
+        """
+        state = dict(n_lines=self.n_lines, sampled=self.sampled, qc=self.qc, blocks=self.blocks,
+                     length_hist=self.length_hist, qual_hist=self.qual_hist,
+                     sketch=self.sketch.to_dict() if self.sketch is not None else None)
+        if self.qc:
+            state.update(base_counts=self.base_counts, cycle_qual_counts=self.cycle_qual_counts, gc_hist=self.gc_hist)
+        return state
+
+    @classmethod
+    def from_dict(cls, state):
+        scanner = cls(qc=state["qc"])
+        scanner.n_lines = int(state["n_lines"])
+        scanner.sampled = state["sampled"]
+        scanner.blocks = state["blocks"]
+        scanner.length_hist = np.asarray(state["length_hist"], dtype=np.int64)
+        scanner.qual_hist = np.asarray(state["qual_hist"], dtype=np.int64)
+        if state["sketch"] is not None:
+            scanner.sketch = ComplexitySketch.from_dict(state["sketch"])
+        if scanner.qc:
+            scanner.base_counts = np.asarray(state["base_counts"], dtype=np.int64).reshape(-1, len(BASES))
+            scanner.cycle_qual_counts = np.asarray(state["cycle_qual_counts"], dtype=np.int64).reshape(-1, N_QUALS)
+            scanner.gc_hist = np.asarray(state["gc_hist"], dtype=np.int64)
+        return scanner
+
+    def pop_hashes(self):
+        hashes = np.concatenate(self.hashes) if self.hashes else np.zeros(0, dtype=np.uint64)
+        self.hashes = []
+        return hashes
+
+    def update(self, buf, ends):
+        """
+        Process all complete lines of the buffer. 'ends' gives the position
+        of the newline characters.
+        """
+        data = np.frombuffer(buf, dtype=np.uint8)
+        starts = np.empty_like(ends)
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+        ## Remove carriage return from line ends
+        eol = ends - (data[np.maximum(ends - 1, 0)] == CARRIAGE_RETURN) * (ends > starts)
+
+        ## Sequences are on the second line of each record
+        first_seq = (1 - self.n_lines) % 4
+        self.add_lengths(eol[first_seq::4] - starts[first_seq::4])
+
+        ## Qualities are on the fourth line of each record
+        first_qual = (3 - self.n_lines) % 4
+        self.add_mean_qualities(data, starts[first_qual::4], eol[first_qual::4])
+
+        if self.hashes is not None:
+            self.add_hashes(data, starts[first_seq::4], eol[first_seq::4])
+        if self.qc:
+            self.add_base_content(data, starts[first_seq::4], eol[first_seq::4])
+            self.add_cycle_qualities(data, starts[first_qual::4], eol[first_qual::4])
+        self.n_lines += ends.size
+
+    def add_lengths(self, lengths):
+        counts = np.bincount(lengths)
+        if counts.size > self.length_hist.size:
+            counts[:self.length_hist.size] += self.length_hist
+            self.length_hist = counts.astype(np.int64)
+        else:
+            self.length_hist[:counts.size] += counts
+
+    def add_mean_qualities(self, data, starts, ends):
+        """
+        Histogram of the mean quality of each read, rounded down as in FastQC.
+        The qualities of each line are summed with a single reduceat call over
+        the interleaved (start, end) positions.
+        """
+        lengths = ends - starts
+        keep = lengths > 0
+        if not keep.any():
+            return
+        starts, ends, lengths = starts[keep], ends[keep], lengths[keep]
+        bounds = np.empty(2 * starts.size, dtype=np.int64)
+        bounds[0::2] = starts
+        bounds[1::2] = ends
+        sums = np.add.reduceat(data, bounds, dtype=np.int64)[0::2]
+        means = np.clip(sums // lengths - PHRED_OFFSET, 0, MAX_QUAL)
+        self.qual_hist += np.bincount(means, minlength=N_QUALS)
+
+    def add_hashes(self, data, starts, ends):
+        """
+        Hash the first PREFIX_LENGTH bases of each read
+        """
+        if starts.size == 0:
+            return
+        lengths = ends - starts
+        prefixes = np.zeros((starts.size, PREFIX_LENGTH), dtype=np.uint8)
+        keep = lengths > 0
+        if keep.any():
+            matrix = line_matrix(data, starts[keep], np.minimum(lengths[keep], PREFIX_LENGTH))
+            prefixes[keep, :matrix.shape[1]] = matrix
+        self.hashes.append(hash_prefixes(prefixes, lengths))
+
+    def add_base_content(self, data, starts, ends):
+        """
+        Count the A/C/G/T/N bases at each cycle, and the GC content (%) of each read
+        """
+        lengths = ends - starts
+        keep = lengths > 0
+        if not keep.any():
+            return
+        starts, lengths = starts[keep], lengths[keep]
+        codes = BASE_CODES[line_matrix(data, starts, lengths)]
+        counts = np.stack([(codes == i).sum(axis=0) for i in range(len(BASES))], axis=1)
+        self.base_counts = add_rows(self.base_counts, counts)
+
+        ## GC content, rounded to the nearest percent
+        n_gc = ((codes == 1) | (codes == 2)).sum(axis=1)
+        self.gc_hist += np.bincount(np.rint(n_gc * 100. / lengths).astype(np.int64), minlength=GC_BINS)
+
+    def add_cycle_qualities(self, data, starts, ends):
+        """
+        Count the quality values at each cycle.
+        The padding gets its own (discarded) quality value.
+        """
+        lengths = ends - starts
+        keep = lengths > 0
+        if not keep.any():
+            return
+        starts, lengths = starts[keep], lengths[keep]
+        quals = QUAL_CODES[line_matrix(data, starts, lengths)]
+        n_cycles = quals.shape[1]
+        quals += np.arange(n_cycles) * (N_QUALS + 1)
+        counts = np.bincount(quals.ravel(), minlength=n_cycles * (N_QUALS + 1))
+        self.cycle_qual_counts = add_rows(self.cycle_qual_counts, counts.reshape(n_cycles, N_QUALS + 1)[:, :N_QUALS])
+
+    def count_qual_above(self, threshold):
+        """
+        Number of reads with a mean quality greater or equal to the threshold
+        """
+        return int(self.qual_hist[threshold:].sum())
+
+    def count_below(self, threshold):
+        """
+        Number of reads with a length strictly lower than the threshold
+        """
+        upper = int(np.ceil(threshold))
+        return int(self.length_hist[:max(upper, 0)].sum())
+
+
+def feed_block(scanner, chunks):
+    """
+    Feed the scanner with a sampled block, and keep the length histogram of the block
+    """
+    before = scanner.length_hist.copy()
+    for chunk in chunks:
+        scanner.feed(chunk)
+    block = scanner.length_hist.copy()
+    block[:before.size] -= before
+    scanner.blocks.append(block)
+
+
+def sample_bgzf(scanner, path, stride, max_reads=None):
+    """
+    Feed the scanner with one part of a BGZF file out of 'stride', each part being read
+    from its offset. With 'max_reads', the stride is widened after the first part, so that
+    about max_reads reads spread over the whole file are used.
+    Return the compressed size of the parts read.
+    """
+    parts = gzip_index.split_bgzf(path, max(os.path.getsize(path) // SAMPLE_PART_SIZE, 1))
+    read_size = 0
+    i = 0
+    while i < len(parts):
+        start, end = parts[i]
+        chunks = gzip_index.read_bgzf_range(path, start, end, chunk_size=SAMPLE_CHUNK_SIZE)
+        feed_block(scanner, PartReader(chunks, first=i == 0).records())
+        scanner.close()
+        read_size += end - start
+        if max_reads and scanner.n_sampled >= max_reads:
+            break
+        if max_reads and i == 0:
+            stride = max(stride, int(len(parts) * scanner.n_sampled / max_reads))
+        i += stride
+    return read_size
+
+
+def sample_stream(scanner, raw, stride, max_reads=None, chunk_size=SAMPLE_CHUNK_SIZE):
+    """
+    Feed the scanner with one block of the stream out of 'stride', and only count
+    the lines of the other blocks. Once 'max_reads' reads were used, the stream is
+    not read anymore. Return the compressed size read.
+    """
+    stream = open_stream(raw)
+    i = 0
+    while True:
+        if max_reads and scanner.n_sampled >= max_reads:
+            ## the incomplete line is not part of the sample
+            scanner.carry = b''
+            return raw.tell()
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if i % stride == 0:
+            feed_block(scanner, [chunk])
+        else:
+            scanner.skip(chunk)
+        i += 1
+    scanner.close()
+    return os.path.getsize(raw.name)
+
+
+def scan_sampled(path, qc=False, fraction=1., max_reads=None):
+    """
+    Compute the statistics of a fastq file on one block out of round(1 / fraction),
+    and on about 'max_reads' reads at most.
+    BGZF files are read at the sampled blocks only (see sample_bgzf). Other files are read
+    up to the last sampled block, and the lines of the skipped blocks are counted.
+    If the file is not read entirely, the number of reads is extrapolated from the
+    compressed size read.
+    The length histogram of each sampled block is kept for the confidence intervals.
+    """
+    scanner = FastqScanner(qc=qc)
+    scanner.blocks = []
+    scanner.sampled = True
+    stride = max(int(round(1. / fraction)), 1)
+    size = os.path.getsize(path)
+    if gzip_index.is_bgzf(path):
+        read_size = sample_bgzf(scanner, path, stride, max_reads=max_reads)
+        n_reads = scanner.n_sampled
+    else:
+        with open(path, 'rb') as raw:
+            read_size = sample_stream(scanner, raw, stride, max_reads=max_reads)
+        n_reads = scanner.n_lines / 4.
+    if 0 < read_size < size:
+        scanner.n_lines = 4 * int(round(n_reads * size / float(read_size)))
+    return scanner
+
+
+def scan_chunks(chunks, qc=False, complexity=False):
+    """
+    Statistics of a stream of chunks.
+    With 'complexity', the reads are added to a sketch, stored in scanner.sketch.
+    """
+    scanner = FastqScanner(qc=qc, hashes=complexity)
+    if not complexity:
+        return scanner.scan(chunks)
+    scanner.sketch = ComplexitySketch()
+    for chunk in chunks:
+        scanner.feed(chunk)
+        scanner.sketch.update(scanner.pop_hashes())
+    scanner.close()
+    scanner.sketch.update(scanner.pop_hashes())
+    return scanner
+
+
+def scan_fastq(path, qc=False, complexity=False, fraction=1., max_reads=None, index_dir=None):
+    """
+    Read a fastq file once and return its statistics.
+    With 'index_dir', a checkpoint index of the (non BGZF) gzip file is built while it is read,
+    and saved in index_dir, so that the file can be split next time.
+    """
+    if fraction < 1. or max_reads:
+        return scan_sampled(path, qc=qc, fraction=fraction, max_reads=max_reads)
+    if index_dir is not None and os.path.getsize(path) >= MIN_SPLIT_SIZE and not gzip_index.is_bgzf(path):
+        gzfile = gzip_index.build_index(path, index_dir)
+        if gzfile is not None:
+            with gzfile:
+                scanner = scan_chunks(iter(lambda: gzfile.read(CHUNK_SIZE), b''), qc=qc, complexity=complexity)
+                gzip_index.save_index(gzfile, path, index_dir)
+            return scanner
+    return scan_chunks(read_chunks(path), qc=qc, complexity=complexity)
+
+
+def scan_part(path, reader, start, end, first, qc=False, complexity=False, index_dir=None):
+    """
+    Statistics of the records of a part of a fastq file
+    """
+    chunks = gzip_index.read_range(path, reader, start, end, index_dir=index_dir)
+    return scan_chunks(PartReader(chunks, first=first).records(), qc=qc, complexity=complexity)
+
+
+def scan_pair(path_r1, path_r2, qc=False):
+    """
+    Read the R1 and R2 fastq files of a sample in lockstep and return their statistics.
+    The pairs of reads are added to a sketch, stored in the R1 scanner.
+    The file with the fewest pending reads is read first, so that only a few chunks
+    of hashes are kept in memory, whatever the read lengths.
+    """
+    scanners = [FastqScanner(qc=qc, hashes=True), FastqScanner(qc=qc, hashes=True)]
+    sketch = scanners[0].sketch = ComplexitySketch()
+    chunks = [prefetch(read_chunks(path_r1)), prefetch(read_chunks(path_r2))]
+    pending = [np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64)]
+    done = [False, False]
+    while not all(done):
+        side = min((i for i in (0, 1) if not done[i]), key=lambda i: pending[i].size)
+        chunk = next(chunks[side], None)
+        if chunk is None:
+            scanners[side].close()
+            done[side] = True
+        else:
+            scanners[side].feed(chunk)
+        pending[side] = np.concatenate((pending[side], scanners[side].pop_hashes()))
+        n_pairs = min(pending[0].size, pending[1].size)
+        sketch.update(hash_pairs(pending[0][:n_pairs], pending[1][:n_pairs]))
+        pending = [pending[0][n_pairs:], pending[1][n_pairs:]]
+    return scanners
+
+
+def scan_job(job):
+    """
+    Scan a part of a file, one fastq file, or a pair of files with complexity estimation
+    """
+    kind, paths, complexity, options, index_dir = job[:5]
+    if kind == 'part':
+        reader, start, end, first = job[5:]
+        return [scan_part(paths[0], reader, start, end, first, qc=options['qc'], complexity=complexity, index_dir=index_dir)]
+    if complexity and len(paths) == 2:
+        return scan_pair(paths[0], paths[1], qc=options['qc'])
+    return [scan_fastq(paths[0], complexity=complexity, index_dir=index_dir, **options)]
+
+
+def scan_all(paths, threads=1, complexity=0, cache=None, split=False, index_dir=None, **options):
+    """
+    Scan a list of fastq files, in parallel if more than one worker is available.
+    The first 'complexity' files (1 for single-end reads, 2 for paired-end reads)
+    are used to estimate the library complexity, and are read by the same worker.
+    With 'split', the threads left once each file has its worker are used to read
+    parts of the large files (see gzip_index.py), and the parts are merged.
+    The files used for the library complexity are not split.
+    With 'index_dir', gzip indexes are built while the files are read, so that they
+    can be split next time.
+    Other options (qc, fraction, max_reads) are passed to scan_fastq().
+    Results are returned in the same order as the input files.
+    """
+    options.setdefault('qc', False)
+    groups = [tuple(paths[:complexity])] + [(path,) for path in paths[complexity:]] if complexity else [(path,) for path in paths]
+    results = [None] * len(groups)
+    keys = [None] * len(groups)
+    if cache is not None:
+        for i, group in enumerate(groups):
+            keys[i] = cache.key("fastq_metrics", group, dict(options, complexity=bool(complexity and i == 0)))
+            results[i] = cache.get(keys[i], convert=lambda states: [FastqScanner.from_dict(state) for state in states])
+    todo = [i for i in range(len(groups)) if results[i] is None]
+
+    ## One job per file (or pair of files), or per part of a file
+    sampled = options.get('fraction', 1.) < 1. or options.get('max_reads')
+    split = split and not sampled
+    ## the sketches of several parts can not be merged exactly, the complexity group keeps one worker
+    splittable = [i for i in todo if not (complexity and i == 0)]
+    free = threads - (len(todo) - len(splittable))
+    n_parts = max(free // len(splittable), 1) if splittable and split else 1
+    index_dir = index_dir if split else None
+    jobs = []
+    for i in todo:
+        group_complexity = bool(complexity and i == 0)
+        parts = None
+        if n_parts > 1 and i in splittable and os.path.getsize(groups[i][0]) >= MIN_SPLIT_SIZE:
+            parts = gzip_index.split_gzip(groups[i][0], n_parts, index_dir)
+        if parts:
+            for k, (reader, start, end) in enumerate(parts):
+                jobs.append((i, ('part', groups[i], group_complexity, options, index_dir, reader, start, end, k == 0)))
+        else:
+            jobs.append((i, ('file', groups[i], group_complexity, options, index_dir if i in splittable else None)))
+
+    workers = min(threads, len(jobs))
+    if workers <= 1:
+        outputs = [scan_job(job) for i, job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outputs = list(pool.map(scan_job, [job for i, job in jobs]))
+
+    ## Merge the parts, in order
+    for (i, job), scanners in zip(jobs, outputs):
+        if results[i] is None:
+            results[i] = scanners
+        else:
+            results[i][0].merge(scanners[0])
+    if cache is not None:
+        for i in todo:
+            cache.put(keys[i], [scanner.to_dict() for scanner in results[i]])
+    return [scanner for scanners in results for scanner in scanners]
+
+
+def awk_number(value):
+    """
+    Format a number as awk's 'print' does (OFMT='%.6g', integers as is)
+    """
+    if value == int(value) and abs(value) < 1e16:
+        return str(int(value))
+    return "%.6g" % value
+
+
+def percent(value, total):
+    if not total:
+        return 'NA'
+    return "{:.2f}".format(value * 100 / total)
+
+
+def extrapolate(count, scanner):
+    """
+    Number of reads of a file, from the number of reads counted on the sampled reads
+    """
+    return int(round(count * scanner.scale)) if scanner.sampled else count
+
+
+def ratio_ci(values, sizes):
+    """
+    Half width of the 95% confidence interval of sum(values) / sum(sizes), estimated
+    from blocks of reads (values and sizes of each block) with the variance between blocks.
+    Contiguous reads are not independent, so that this interval is wider than the one
+    computed as if the reads were drawn one by one.
+    """
+    k = len(sizes)
+    total = float(np.sum(sizes))
+    if k < 2 or total == 0:
+        return None
+    ratio = np.sum(values) / total
+    var = k / (k - 1.) * np.sum((values - ratio * sizes) ** 2) / total ** 2
+    return Z_95 * math.sqrt(var)
+
+
+def trimmed_ci(parts, n_reads):
+    """
+    Half width of the 95% confidence interval of the percentage of trimmed reads,
+    from the (scanner, length threshold) of each trimmed file
+    """
+    if not n_reads:
+        return 'NA'
+    var = 0.
+    for scanner, threshold in parts:
+        ci = scanner.count_below_ci(threshold)
+        if ci is None:
+            return 'NA'
+        var += (ci * scanner.n_reads) ** 2
+    return "{:.2f}".format(math.sqrt(var) * 100 / n_reads)
+
+
+def compute_metrics(sample, raw, raw_r2=None, trim=None, trim_r2=None):
+    """
+    Compute the general metrics of a sample from the statistics of its
+    raw and trimmed fastq files
+    """
+    n_frag = raw.n_reads
+    n_reads = n_frag
+    mean_length = awk_number(raw.mean_length) if raw.mean_length is not None else 'NA'
+    total_base = extrapolate(raw.total_bases, raw)
+
+    mean_length_r2 = None
+    if raw_r2 is not None:
+        mean_length_r2 = awk_number(raw_r2.mean_length) if raw_r2.mean_length is not None else 'NA'
+        if 'NA' not in (mean_length, mean_length_r2):
+            mean_length = str(int((float(mean_length) + float(mean_length_r2)) / 2))
+        total_base += extrapolate(raw_r2.total_bases, raw_r2)
+        n_reads = n_reads * 2
+
+    n_trim = p_trim = trim_mean_length = n_discarded = p_discarded = 'NA'
+    if trim is not None:
+        n_after_trim = trim.n_reads
+        if trim.mean_length is not None:
+            trim_mean_length = "{:.0f}".format(trim.mean_length)
+        n_trim = extrapolate(trim.count_below(float(mean_length)), trim) if mean_length != 'NA' else 0
+        p_trim = percent(n_trim, n_frag)
+        ## the numbers of reads of partly read files are estimated, and may be inconsistent
+        n_discarded = max(n_frag - n_after_trim, 0)
+        p_discarded = percent(n_discarded, n_frag)
+
+        if trim_r2 is not None:
+            if trim_r2.mean_length is not None and trim_mean_length != 'NA':
+                trim_mean_length_r2 = int("{:.0f}".format(trim_r2.mean_length))
+                trim_mean_length = str((int(trim_mean_length) + trim_mean_length_r2) // 2)
+            n_trim_r2 = extrapolate(trim_r2.count_below(float(mean_length_r2)), trim_r2) if mean_length_r2 not in (None, 'NA') else 0
+            p_trim = percent(n_trim + n_trim_r2, n_reads)
+
+    values = [sample, n_frag, mean_length, total_base, trim_mean_length,
+              n_trim, p_trim, n_discarded, p_discarded]
+    metrics = OrderedDict(zip(HEADER, values))
+
+    ## Library complexity, from the sketch of the raw fragments
+    if raw.sketch is not None:
+        distinct = raw.sketch.distinct
+        dup_ci = raw.sketch.duplicates_ci
+        values = [distinct, percent(raw.sketch.n_frag - distinct, raw.sketch.n_frag),
+                  "{:.2f}".format(dup_ci) if dup_ci is not None else 'NA', raw.sketch.max_duplication]
+        metrics.update(zip(COMPLEXITY_HEADER, values))
+
+    ## Confidence intervals of the values estimated on sampled reads
+    if raw.sampled:
+        mean_ci = raw.mean_length_ci
+        if raw_r2 is not None and mean_ci is not None and raw_r2.mean_length_ci is not None:
+            mean_ci = math.sqrt(mean_ci ** 2 + raw_r2.mean_length_ci ** 2) / 2
+        trim_ci = 'NA'
+        if trim is not None and mean_length != 'NA':
+            parts = [(trim, float(mean_length))]
+            if trim_r2 is not None and mean_length_r2 not in (None, 'NA'):
+                parts.append((trim_r2, float(mean_length_r2)))
+            trim_ci = trimmed_ci(parts, n_reads)
+        values = [raw.n_sampled, "{:.2f}".format(mean_ci) if mean_ci is not None else 'NA', trim_ci]
+        metrics.update(zip(SAMPLING_HEADER, values))
+    return metrics
+
+
+def write_seqqual(scanner, output):
+    """
+    Write the per sequence quality scores as FastQC does ('Per sequence quality scores' module):
+    one line per mean quality value, with the number of reads.
+    """
+    observed = np.flatnonzero(scanner.qual_hist)
+    if observed.size == 0:
+        return
+    with open(output, 'w') as out:
+        for qual in range(observed[0], observed[-1] + 1):
+            out.write("{}\t{}\n".format(qual, extrapolate(int(scanner.qual_hist[qual]), scanner)))
+
+
+def count_quantiles(counts, probs):
+    """
+    Quantiles of the values of each row of a count matrix (values are the column indexes)
+    """
+    cumul = np.cumsum(counts, axis=1)
+    totals = cumul[:, -1:]
+    return [(cumul < p * totals).sum(axis=1) for p in probs]
+
+
+def write_qc(scanner, prefix):
+    """
+    Write the per base and per sequence QC of a fastq file:
+    - <prefix>_basequal.tsv: mean quality at each cycle
+    - <prefix>_basequal_quantiles.tsv: quantiles of the quality at each cycle
+    - <prefix>_basecontent.tsv: percentage of A/C/G/T/N at each cycle
+    - <prefix>_ncontent.tsv: percentage of N at each cycle
+    - <prefix>_gccontent.tsv: number of reads per GC content (%)
+    The quantiles and base content files have one line per series ('<prefix> <name>')
+    and one column per cycle, as read by the MultiQC custom content line graphs.
+    """
+    quals = scanner.cycle_qual_counts
+    n_quals = quals.sum(axis=1)
+    cycles = np.flatnonzero(n_quals)
+    if cycles.size > 0:
+        means = np.dot(quals, np.arange(N_QUALS)) / np.maximum(n_quals, 1)
+        quantiles = count_quantiles(quals, QUANTILES.values())
+        with open("{}_basequal.tsv".format(prefix), 'w') as out:
+            for i in cycles:
+                out.write("{}\t{:.2f}\n".format(i + 1, means[i]))
+        with open("{}_basequal_quantiles.tsv".format(prefix), 'w') as out:
+            for name, q in zip(QUANTILES.keys(), quantiles):
+                out.write("\t".join(["{} {}".format(prefix, name)] + [str(q[i]) for i in cycles]) + "\n")
+
+    bases = scanner.base_counts
+    n_bases = bases.sum(axis=1)
+    cycles = np.flatnonzero(n_bases)
+    if cycles.size > 0:
+        percents = bases * 100. / np.maximum(n_bases, 1)[:, None]
+        with open("{}_basecontent.tsv".format(prefix), 'w') as out:
+            for j, base in enumerate(BASES):
+                out.write("\t".join(["{} {}".format(prefix, base)] + ["{:.2f}".format(percents[i, j]) for i in cycles]) + "\n")
+        with open("{}_ncontent.tsv".format(prefix), 'w') as out:
+            for i in cycles:
+                out.write("{}\t{:.2f}\n".format(i + 1, percents[i, BASES.index('N')]))
+
+    if scanner.gc_hist.any():
+        with open("{}_gccontent.tsv".format(prefix), 'w') as out:
+            for gc in range(GC_BINS):
+                out.write("{}\t{}\n".format(gc, scanner.gc_hist[gc]))
+
+
+def write_saturation(sketch, output):
+    """
+    Write the saturation curve: number of fragments and estimated number of distinct fragments
+    """
+    points = sketch.saturation_curve()
+    if not points:
+        return
+    with open(output, 'w') as out:
+        for n_frag, distinct in points:
+            out.write("{}\t{}\n".format(n_frag, distinct))
+
+
+def write_metrics(metrics, out):
+    out.write(",".join(metrics.keys()) + "\n")
+    out.write(",".join(map(str, metrics.values())) + "\n")
+
+
+def seqqual_counts(scanner):
+    """
+    Per sequence quality scores as a list of [mean quality, number of reads], as in write_seqqual()
+    """
+    observed = np.flatnonzero(scanner.qual_hist)
+    if observed.size == 0:
+        return []
+    return [[qual, extrapolate(int(scanner.qual_hist[qual]), scanner)] for qual in range(observed[0], observed[-1] + 1)]
+
+
+def write_fragment(sample, metrics, seqqual, output):
+    """
+    Write the pre-parsed results of a sample for the MultiQC report: the row of the
+    general metrics table, and the per sequence quality scores of each read
+    """
+    fragment = OrderedDict([("type", "general"), ("sample", sample),
+                            ("stats", OrderedDict((k, str(v)) for k, v in metrics.items())),
+                            ("seqqual", OrderedDict((read, seqqual_counts(scanner)) for read, scanner in seqqual.items()))])
+    with open(output, 'w') as f:
+        json.dump(fragment, f)
+
+
+if __name__ == '__main__':
+    args = get_options()
+
+    if not os.path.exists(args.input):
+        sys.stderr.write("{} file not found\n".format(args.input))
+        sys.exit(1)
+
+    ## Sample name
+    sample = args.sample if args.sample else os.path.basename(args.input).replace('.fastq.gz', '')
+
+    if not 0. < args.sample_fraction <= 1.:
+        sys.stderr.write("--sample_fraction must be in ]0, 1]\n")
+        sys.exit(1)
+
+    ## Trimmed R2 is only used together with trimmed R1
+    inputs = OrderedDict([('raw', args.input), ('raw_r2', args.input_r2), ('trim', args.trimmed), ('trim_r2', args.trimmed_r2)])
+    inputs = OrderedDict((k, v) for k, v in inputs.items() if v and os.path.exists(v))
+    if 'trim' not in inputs:
+        inputs.pop('trim_r2', None)
+
+    ## The library complexity can not be estimated on sampled reads
+    sampling = args.sample_fraction < 1. or args.max_reads
+    if sampling and args.complexity:
+        sys.stderr.write("Library complexity is not estimated on sampled reads\n")
+        args.complexity = False
+    complexity = (2 if 'raw_r2' in inputs else 1) if args.complexity else 0
+
+    cache = None
+    if args.cache and not args.no_cache:
+        cache = ResultCache(args.cache, version=source_version([__file__, sketches.__file__, gzip_index.__file__]),
+                            max_size=args.cache_size * 1024 * 1024)
+
+    index_dir = args.index_dir
+
+    perf = PerfRecorder("fastq_metrics", sample=sample)
+    with perf.stage("scan") as st:
+        stats = dict(zip(inputs.keys(), scan_all(list(inputs.values()), threads=args.threads, complexity=complexity, cache=cache,
+                                                    split=args.split, index_dir=index_dir,
+                                                    qc=args.qc, fraction=args.sample_fraction, max_reads=args.max_reads)))
+        st.add(bytes_read=file_size(inputs.values()), records=sum(s.n_lines // 4 for s in stats.values()))
+    raw, raw_r2, trim, trim_r2 = [stats.get(k) for k in ('raw', 'raw_r2', 'trim', 'trim_r2')]
+
+    with perf.stage("write"):
+        metrics = compute_metrics(sample, raw, raw_r2, trim, trim_r2)
+
+        ## Per sequence quality of the trimmed reads, or raw reads if not trimmed
+        reads = [trim, trim_r2] if trim is not None else [raw, raw_r2]
+        if args.seqqual:
+            if reads[1] is None:
+                write_seqqual(reads[0], "{}_seqqual.tsv".format(sample))
+            else:
+                write_seqqual(reads[0], "{}_R1_seqqual.tsv".format(sample))
+                write_seqqual(reads[1], "{}_R2_seqqual.tsv".format(sample))
+
+        if args.complexity:
+            write_saturation(raw.sketch, "{}_saturation.tsv".format(sample))
+
+        ## Per base QC of the raw and trimmed reads
+        if args.qc:
+            for key, scanner in stats.items():
+                mate = "_R2" if key.endswith('_r2') else "_R1" if raw_r2 is not None else ""
+                step = "_trimmed" if key.startswith('trim') else "_raw"
+                write_qc(scanner, "{}{}{}".format(sample, mate, step))
+
+        if args.output:
+            with open(args.output, 'w') as out:
+                write_metrics(metrics, out)
+        else:
+            write_metrics(metrics, sys.stdout)
+
+        if args.fragment:
+            seqqual = OrderedDict(zip(("R1", "R2"), [r for r in reads if r is not None])) if args.seqqual else {}
+            write_fragment(sample, metrics, seqqual, "{}.general.fragment.json".format(sample))
+
+    perf.write(sample)
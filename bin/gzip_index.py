@@ -0,0 +1,307 @@
+#############################################################################################
+# Copyright Institut Curie 2022                                                             #
+#                                                                                           #
+# This software is a computer program whose purpose                                         #
+# is to analyze high-throughput sequencing data.                                            #
+# You can use, modify and/ or redistribute the software under                               #
+# the terms of license (see the LICENSE file for more details).                             #
+# The software is distributed in the hope that it will be useful,                           #
+# but "AS IS" WITHOUT ANY WARRANTY OF ANY KIND.                                             #
+# Users are therefore encouraged to test the software's suitabilityas regards               #
+# their requirements in conditions enabling the security of their systems and/or data.      #
+# The fact that you are presently reading this means that                                   #
+# you have had knowledge of the license and that you accept its terms.                      #
+#############################################################################################
+
+"""
+Random access to gzip files, to split one fastq file in several parts.
+- BGZF files (bgzip) are split on their block boundaries. The block offsets are
+  saved in a bgzip-compatible '.gzi' index.
+- Other gzip files are split with a zran-style checkpoint index built by the
+  optional 'indexed_gzip' package, and saved in a '.gzidx' file.
+Each part is read as a sequence of (chunk, in_range) pairs: the data of the part
+itself, followed by the data of the next parts, so that the last record of the part
+can be completed.
+Indexes saved in a shared directory (index_dir) are named by the identity of the
+gzip file (see qc_cache.file_identity), so that files with the same name in other
+runs never use them. They are evicted with the cache entries of this directory.
+"""
+
+import os
+import json
+import zlib
+import struct
+import hashlib
+import tempfile
+
+from qc_cache import file_identity
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+CHUNK_SIZE = 4 * 1024 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+BGZF_HEADER_SIZE = 18
+INDEX_SPACING = 8 * 1024 * 1024
+TAIL_SIZE = 64 * 1024
+
+
+def is_bgzf(path):
+    """
+    BGZF files are gzip files with a 'BC' extra field giving the block size
+    """
+    with open(path, 'rb') as f:
+        header = f.read(BGZF_HEADER_SIZE)
+    return (len(header) == BGZF_HEADER_SIZE and header[:2] == GZIP_MAGIC
+            and header[3] & 4 and header[12:14] == b'BC' and struct.unpack('<H', header[14:16])[0] == 2)
+
+
+def index_path(path, index_dir, ext):
+    """
+    Index of a file in index_dir, named by its identity, or next to the file
+    """
+    if index_dir is None:
+        return path + ext
+    ident = hashlib.sha1(json.dumps(file_identity(path)).encode('utf-8')).hexdigest()
+    return os.path.join(index_dir, "{}.{}{}".format(os.path.basename(path), ident, ext))
+
+
+def find_index(path, index_dir, ext):
+    """
+    Existing index of a file: in index_dir (its access time is then updated for
+    the eviction of the least recently used files), or next to the file if it is newer
+    """
+    if index_dir is not None:
+        index = index_path(path, index_dir, ext)
+        if os.path.exists(index):
+            os.utime(index, None)
+            return index
+    index = path + ext
+    if os.path.exists(index) and os.path.getmtime(index) >= os.path.getmtime(path):
+        return index
+    return None
+
+
+def replace_file(index, write):
+    """
+    Write a file atomically with write(tmp), from a unique temporary file,
+    so that concurrent tasks can write the same index
+    """
+    directory = os.path.dirname(os.path.abspath(index))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, index)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def read_gzi(gzi):
+    """
+    Compressed offsets of the blocks, from a bgzip '.gzi' index
+    (number of entries, then (compressed, uncompressed) offsets, first block excluded)
+    """
+    with open(gzi, 'rb') as f:
+        n = struct.unpack('<Q', f.read(8))[0]
+        values = struct.unpack('<{}Q'.format(2 * n), f.read(16 * n))
+    return [0] + list(values[0::2])
+
+
+def write_gzi(gzi, offsets):
+    """
+    Write the block offsets as a bgzip '.gzi' index. Uncompressed offsets are not
+    computed, and set to 0.
+    """
+    def write(tmp):
+        with open(tmp, 'wb') as f:
+            f.write(struct.pack('<Q', len(offsets) - 1))
+            for offset in offsets[1:]:
+                f.write(struct.pack('<QQ', offset, 0))
+    replace_file(gzi, write)
+
+
+def bgzf_offsets(path):
+    """
+    Compressed offsets of all BGZF blocks, read from the block headers
+    """
+    offsets = []
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        offset = 0
+        while offset < size:
+            f.seek(offset)
+            header = f.read(BGZF_HEADER_SIZE)
+            if len(header) < BGZF_HEADER_SIZE or header[:2] != GZIP_MAGIC:
+                raise IOError("Invalid BGZF block at offset {} in {}".format(offset, path))
+            offsets.append(offset)
+            offset += struct.unpack('<H', header[16:18])[0] + 1
+    return offsets
+
+
+def get_bgzf_offsets(path, index_dir=None):
+    """
+    Block offsets from an existing '.gzi' index (in index_dir or next to the file),
+    or from the block headers. The index is then saved in index_dir.
+    """
+    gzi = find_index(path, index_dir, ".gzi")
+    if gzi is not None:
+        return read_gzi(gzi)
+    offsets = bgzf_offsets(path)
+    if index_dir is not None:
+        write_gzi(index_path(path, index_dir, ".gzi"), offsets)
+    return offsets
+
+
+def split_bgzf(path, n_parts, index_dir=None):
+    """
+    Split a BGZF file in parts of about the same compressed size,
+    as a list of (start, end) compressed offsets
+    """
+    offsets = get_bgzf_offsets(path, index_dir)
+    size = os.path.getsize(path)
+    bounds = [0]
+    for i in range(1, n_parts):
+        target = size * i // n_parts
+        start = next((o for o in offsets if o >= target), size)
+        if start > bounds[-1] and start < size:
+            bounds.append(start)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def inflate_blocks(raw, limit=None, chunk_size=CHUNK_SIZE):
+    """
+    Decompress BGZF blocks, up to 'limit' compressed bytes. Each block is read
+    with the size given in its header, and the small blocks are joined in chunks
+    of about chunk_size bytes.
+    """
+    remaining = limit
+    buf = []
+    buf_size = 0
+    while remaining is None or remaining > 0:
+        header = raw.read(BGZF_HEADER_SIZE)
+        if len(header) < BGZF_HEADER_SIZE:
+            break
+        block_size = struct.unpack('<H', header[16:18])[0] + 1
+        block = raw.read(block_size - BGZF_HEADER_SIZE)
+        if remaining is not None:
+            remaining -= block_size
+        ## deflate data, without the CRC32 and ISIZE trailer
+        out = zlib.decompress(block[:-8], -zlib.MAX_WBITS)
+        if out:
+            buf.append(out)
+            buf_size += len(out)
+        if buf_size >= chunk_size:
+            yield b''.join(buf)
+            buf = []
+            buf_size = 0
+    if buf:
+        yield b''.join(buf)
+
+
+def read_bgzf_range(path, start, end, chunk_size=CHUNK_SIZE):
+    """
+    Yield (chunk, in_range): the blocks between the compressed offsets start and end,
+    then the following blocks, by smaller chunks as only the last record of the range
+    is needed
+    """
+    with open(path, 'rb') as raw:
+        raw.seek(start)
+        for chunk in inflate_blocks(raw, limit=end - start, chunk_size=chunk_size):
+            yield chunk, True
+        for chunk in inflate_blocks(raw, chunk_size=TAIL_SIZE):
+            yield chunk, False
+
+
+def load_index(path, index_dir=None):
+    """
+    Open a gzip file with its checkpoint index, if it was already built
+    """
+    if indexed_gzip is None:
+        return None
+    index = find_index(path, index_dir, ".gzidx")
+    if index is not None:
+        return indexed_gzip.IndexedGzipFile(path, index_file=index, spacing=INDEX_SPACING)
+    return None
+
+
+def build_index(path, index_dir=None):
+    """
+    Open a gzip file which builds its checkpoint index while it is read.
+    The index is written by save_index() once the file was read.
+    """
+    if indexed_gzip is None:
+        return None
+    return indexed_gzip.IndexedGzipFile(path, spacing=INDEX_SPACING)
+
+
+def save_index(gzfile, path, index_dir=None):
+    replace_file(index_path(path, index_dir, ".gzidx"), gzfile.export_index)
+
+
+def uncompressed_size(gzfile):
+    return gzfile.seek(0, os.SEEK_END)
+
+
+def split_indexed(path, n_parts, index_dir=None):
+    """
+    Split an indexed gzip file in parts of about the same uncompressed size,
+    as a list of (start, end) uncompressed offsets
+    """
+    gzfile = load_index(path, index_dir)
+    if gzfile is None:
+        return None
+    with gzfile:
+        size = uncompressed_size(gzfile)
+    bounds = [size * i // n_parts for i in range(n_parts + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_indexed_range(path, start, end, index_dir=None, chunk_size=CHUNK_SIZE):
+    """
+    Yield (chunk, in_range): the data between the uncompressed offsets start and end,
+    then the following data
+    """
+    gzfile = load_index(path, index_dir)
+    if gzfile is None:
+        raise IOError("The index of {} was removed from {}".format(path, index_dir))
+    with gzfile:
+        gzfile.seek(start)
+        pos = start
+        while True:
+            chunk = gzfile.read(chunk_size)
+            if not chunk:
+                break
+            if pos < end < pos + len(chunk):
+                yield chunk[:end - pos], True
+                yield chunk[end - pos:], False
+            else:
+                yield chunk, pos < end
+            pos += len(chunk)
+
+
+def split_gzip(path, n_parts, index_dir=None):
+    """
+    Split a gzip file in n_parts parts if it can be read from several offsets.
+    Return the parts as a list of (reader, start, end), with reader 'bgzf' or 'indexed',
+    or None if the file can not be split.
+    """
+    if n_parts < 2:
+        return None
+    if is_bgzf(path):
+        return [('bgzf', start, end) for start, end in split_bgzf(path, n_parts, index_dir)]
+    parts = split_indexed(path, n_parts, index_dir)
+    if parts is not None:
+        return [('indexed', start, end) for start, end in parts]
+    return None
+
+
+def read_range(path, reader, start, end, index_dir=None, chunk_size=CHUNK_SIZE):
+    if reader == 'bgzf':
+        return read_bgzf_range(path, start, end, chunk_size=chunk_size)
+    return read_indexed_range(path, start, end, index_dir=index_dir, chunk_size=chunk_size)
@@ -1,11 +1,12 @@
 #!/usr/bin/env python
 from __future__ import print_function
 import argparse
-import markdown
 import os
 import sys
 
 def convert_markdown(in_fn):
+    ## imported here, as the module is slow to load
+    import markdown
     input_md = open(in_fn, mode="r", encoding="utf-8").read()
     html = markdown.markdown(
         "[TOC]\n" + input_md,
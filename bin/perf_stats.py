@@ -0,0 +1,174 @@
+#############################################################################################
+# Copyright Institut Curie 2022                                                             #
+#                                                                                           #
+# This software is a computer program whose purpose                                         #
+# is to analyze high-throughput sequencing data.                                            #
+# You can use, modify and/ or redistribute the software under                               #
+# the terms of license (see the LICENSE file for more details).                             #
+# The software is distributed in the hope that it will be useful,                           #
+# but "AS IS" WITHOUT ANY WARRANTY OF ANY KIND.                                             #
+# Users are therefore encouraged to test the software's suitabilityas regards               #
+# their requirements in conditions enabling the security of their systems and/or data.      #
+# The fact that you are presently reading this means that                                   #
+# you have had knowledge of the license and that you accept its terms.                      #
+#############################################################################################
+
+"""
+Per-stage performance statistics of the python scripts of the pipeline.
+When the RAWQC_PERF environment variable is set, each stage of a script records its
+wall time, CPU time (including the child processes), bytes read, records processed
+and the peak resident memory of the script. The stages are written in a small
+'<prefix>.<tool>.perf.json' file, aggregated in the MultiQC report by stats2multiqc.py.
+When the variable is not set, the recorder does nothing.
+"""
+
+import os
+import json
+import time
+import resource
+from contextlib import contextmanager
+from collections import OrderedDict
+
+ENV_VAR = "RAWQC_PERF"
+PERF_SUFFIX = ".perf.json"
+MB = 1024. * 1024.
+
+
+def is_enabled():
+    return os.environ.get(ENV_VAR, "").lower() not in ("", "0", "false", "no")
+
+
+def cpu_time():
+    """
+    User and system time of the process and of its terminated child processes
+    """
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def peak_rss():
+    """
+    Peak resident memory (MB) of the process, or of its largest child process
+    (ru_maxrss is in kB on Linux)
+    """
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024.
+
+
+class Stage(object):
+    """
+    Counters of a running stage
+    """
+
+    def __init__(self, name, sample=None):
+        self.name = name
+        self.sample = sample
+        self.bytes_read = 0
+        self.records = 0
+
+    def add(self, bytes_read=0, records=0):
+        self.bytes_read += bytes_read
+        self.records += records
+
+
+class PerfRecorder(object):
+    """
+    Record the stages of a script, ie.
+
+    perf = PerfRecorder("fastq_metrics", sample="S1")
+    with perf.stage("scan") as st:
+        ...
+        st.add(bytes_read=size, records=n_reads)
+    perf.write("S1")
+    """
+
+    def __init__(self, tool, sample=None, enabled=None):
+        self.tool = tool
+        self.sample = sample
+        self.enabled = is_enabled() if enabled is None else enabled
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, sample=None):
+        st = Stage(name, sample=sample or self.sample)
+        if not self.enabled:
+            yield st
+            return
+        wall, cpu = time.time(), cpu_time()
+        yield st
+        wall, cpu = time.time() - wall, cpu_time() - cpu
+        self.stages.append(OrderedDict([
+            ("sample", st.sample),
+            ("stage", name),
+            ("wall_seconds", round(wall, 3)),
+            ("cpu_seconds", round(cpu, 3)),
+            ("bytes_read", st.bytes_read),
+            ("records", st.records),
+            ("peak_rss_mb", round(peak_rss(), 1))
+        ]))
+
+    def to_dict(self):
+        import socket
+        return OrderedDict([("tool", self.tool), ("host", socket.gethostname()), ("stages", self.stages)])
+
+    def write(self, prefix, output_dir="."):
+        """
+        Write the stages in '<prefix>.<tool>.perf.json', if enabled
+        """
+        if not self.enabled or not self.stages:
+            return None
+        output = os.path.join(output_dir, "{}.{}{}".format(prefix, self.tool, PERF_SUFFIX))
+        with open(output, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return output
+
+
+def file_size(paths):
+    return sum(os.path.getsize(p) for p in paths if p and os.path.exists(p))
+
+
+def load_perf_files(perf_dir):
+    """
+    Records of all '*.perf.json' files of a directory
+    """
+    records = []
+    if not perf_dir or not os.path.isdir(perf_dir):
+        return records
+    for name in sorted(os.listdir(perf_dir)):
+        if name.endswith(PERF_SUFFIX):
+            with open(os.path.join(perf_dir, name)) as f:
+                records.append(json.load(f))
+    return records
+
+
+def perf_rows(records):
+    """
+    Rows of the MultiQC 'Pipeline performance' table, one per sample, tool and stage
+    """
+    rows = []
+    for rec in records:
+        for st in rec.get("stages", []):
+            wall = st["wall_seconds"]
+            row = OrderedDict()
+            row["Sample_id"] = "{} [{} {}]".format(st.get("sample") or "all", rec["tool"], st["stage"])
+            row["Host"] = rec.get("host", "NA")
+            row["Wall_time"] = "{:.2f}".format(wall)
+            row["CPU_time"] = "{:.2f}".format(st["cpu_seconds"])
+            row["MB_read"] = "{:.1f}".format(st["bytes_read"] / MB)
+            row["Records"] = str(st["records"])
+            row["MB_per_s"] = "{:.2f}".format(st["bytes_read"] / MB / wall) if wall > 0 else "NA"
+            row["Records_per_s"] = "{:.0f}".format(st["records"] / wall) if wall > 0 else "NA"
+            row["Peak_RSS_MB"] = "{:.1f}".format(st["peak_rss_mb"])
+            rows.append(row)
+    return rows
+
+
+def write_perf_table(records, output):
+    rows = perf_rows(records)
+    if not rows:
+        return None
+    with open(output, 'w') as out:
+        out.write("\t".join(rows[0].keys()) + "\n")
+        for row in rows:
+            out.write("\t".join(row.values()) + "\n")
+    return output
@@ -0,0 +1,196 @@
+#############################################################################################
+# Copyright Institut Curie 2022                                                             #
+#                                                                                           #
+# This software is a computer program whose purpose                                         #
+# is to analyze high-throughput sequencing data.                                            #
+# You can use, modify and/ or redistribute the software under                               #
+# the terms of license (see the LICENSE file for more details).                             #
+# The software is distributed in the hope that it will be useful,                           #
+# but "AS IS" WITHOUT ANY WARRANTY OF ANY KIND.                                             #
+# Users are therefore encouraged to test the software's suitabilityas regards               #
+# their requirements in conditions enabling the security of their systems and/or data.      #
+# The fact that you are presently reading this means that                                   #
+# you have had knowledge of the license and that you accept its terms.                      #
+#############################################################################################
+
+"""
+Persistent on-disk cache of the per-sample QC results.
+Entries are keyed by the identity of the input files (size, modification time,
+hash of the first and last blocks), the version of the code and the parameters.
+The least recently used entries, and gzip indexes, are removed when the cache exceeds its maximum size.
+Entries are stored as JSON, or as a npz file of numpy arrays with the JSON document
+when the value holds arrays, and are never unpickled: the cache directory can be
+shared without running the code of the users who write to it.
+"""
+
+import os
+import json
+import zipfile
+import hashlib
+import tempfile
+
+BLOCK_SIZE = 64 * 1024
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+JSON_SUFFIX = ".json"
+NPZ_SUFFIX = ".npz"
+## Pickled entries of the previous versions are not read anymore, only evicted.
+## The gzip indexes saved in the cache directory (see gzip_index.py) are evicted too.
+ENTRY_SUFFIXES = (JSON_SUFFIX, NPZ_SUFFIX, ".pkl", ".gzi", ".gzidx")
+ARRAY_KEY = "__array__"
+JSON_MEMBER = "__json__"
+
+
+def file_identity(path):
+    """
+    Size, modification time and hash of the first and last blocks of a file.
+    Symbolic links (ie. Nextflow staged files) are followed.
+    """
+    st = os.stat(path)
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        sha.update(f.read(BLOCK_SIZE))
+        if st.st_size > BLOCK_SIZE:
+            f.seek(max(st.st_size - BLOCK_SIZE, BLOCK_SIZE))
+            sha.update(f.read(BLOCK_SIZE))
+    return [st.st_size, int(st.st_mtime), sha.hexdigest()]
+
+
+def source_version(paths):
+    """
+    Version of the code, as the hash of its source files and of this module,
+    which defines the format of the entries
+    """
+    sha = hashlib.sha1()
+    for path in list(paths) + [__file__]:
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def encode(value, arrays):
+    """
+    JSON-serializable copy of a value, its numpy arrays being replaced by
+    references to the 'arrays' dict
+    """
+    if isinstance(value, dict):
+        return dict((k, encode(v, arrays)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [encode(v, arrays) for v in value]
+    if type(value).__module__ == 'numpy':
+        if getattr(value, 'ndim', 0) == 0:
+            return value.item()
+        name = "a{}".format(len(arrays))
+        arrays[name] = value
+        return {ARRAY_KEY: name}
+    return value
+
+
+def decode(value, arrays):
+    """
+    Value of an encoded JSON document, with its numpy arrays
+    """
+    if isinstance(value, dict):
+        if ARRAY_KEY in value:
+            return arrays[value[ARRAY_KEY]]
+        return dict((k, decode(v, arrays)) for k, v in value.items())
+    if isinstance(value, list):
+        return [decode(v, arrays) for v in value]
+    return value
+
+
+class ResultCache(object):
+    """
+    Directory of results, as JSON or npz files. Reading an entry updates its
+    modification time, which is used to find the least recently used entries.
+    """
+
+    def __init__(self, directory, version, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.version = version
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, tool, paths, params=None):
+        ident = [tool, self.version, [file_identity(p) for p in paths], params or {}]
+        return hashlib.sha256(json.dumps(ident, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def entry(self, key, suffix=JSON_SUFFIX):
+        return os.path.join(self.directory, key + suffix)
+
+    def load(self, key):
+        for suffix in (JSON_SUFFIX, NPZ_SUFFIX):
+            path = self.entry(key, suffix)
+            if not os.path.exists(path):
+                continue
+            if suffix == JSON_SUFFIX:
+                with open(path) as f:
+                    value = json.load(f)
+            else:
+                ## numpy is only needed for the entries with arrays
+                import numpy as np
+                with np.load(path, allow_pickle=False) as npz:
+                    arrays = dict((name, npz[name]) for name in npz.files if name != JSON_MEMBER)
+                    value = decode(json.loads(str(npz[JSON_MEMBER])), arrays)
+            os.utime(path, None)
+            return value
+        return None
+
+    def get(self, key, convert=None):
+        """
+        Value of an entry, converted with 'convert' if given, or None if the entry
+        is missing or can not be read (ie. written by another version of the code)
+        """
+        try:
+            value = self.load(key)
+            if value is not None and convert is not None:
+                value = convert(value)
+            return value
+        except (IOError, OSError, EOFError, ValueError, KeyError, IndexError, TypeError,
+                AttributeError, ImportError, zipfile.BadZipFile):
+            return None
+
+    def put(self, key, value):
+        """
+        Write an entry atomically, so that concurrent tasks can share the cache
+        """
+        arrays = {}
+        doc = json.dumps(encode(value, arrays))
+        suffix = NPZ_SUFFIX if arrays else JSON_SUFFIX
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if arrays:
+                    import numpy as np
+                    arrays[JSON_MEMBER] = np.array(doc)
+                    np.savez(f, **arrays)
+                else:
+                    f.write(doc.encode('utf-8'))
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.entry(key, suffix))
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_size
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(ENTRY_SUFFIXES):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
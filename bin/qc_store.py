@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+
+
+#############################################################################################
+# Copyright Institut Curie 2022                                                             #
+#                                                                                           #
+# This software is a computer program whose purpose                                         #
+# is to analyze high-throughput sequencing data.                                            #
+# You can use, modify and/ or redistribute the software under                               #
+# the terms of license (see the LICENSE file for more details).                             #
+# The software is distributed in the hope that it will be useful,                           #
+# but "AS IS" WITHOUT ANY WARRANTY OF ANY KIND.                                             #
+# Users are therefore encouraged to test the software's suitabilityas regards               #
+# their requirements in conditions enabling the security of their systems and/or data.      #
+# The fact that you are presently reading this means that                                   #
+# you have had knowledge of the license and that you accept its terms.                      #
+#############################################################################################
+
+"""
+Historical store of the QC results of all runs, in a SQLite database.
+- import: add the per-sample metrics of a run (mq.stats, trimming tables), its
+  histograms (per sequence quality, saturation, per base QC, ...) and metadata.
+  A run imported again replaces the previous import.
+- percentiles: percentiles of a metric over all runs (or since a date)
+- trend: median of a metric per month or year
+- histogram: a stored histogram of a sample, as a tsv table
+- outliers: samples of a run outside the historical distribution of the metrics
+  (Tukey fences), optionally as a MultiQC table with the percentile of each value
+Metrics are stored one value per row, indexed by (metric, value), so that percentiles
+and ranks are read from the index without loading the values. Histograms are stored
+as columnar blobs (one array of doubles per column).
+
+Example:
+  qc_store.py import --db qc.sqlite --run RUN1 --stats mq.stats --trimming all_*_metrics.trim.tsv --hist stats/*.tsv
+  qc_store.py percentiles --db qc.sqlite --metric Percent_duplicates
+  qc_store.py outliers --db qc.sqlite --run RUN1 --mqc historical_qc.tsv
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import array
+import sqlite3
+import argparse
+from collections import OrderedDict
+
+PERCENTILES = [5, 25, 50, 75, 95]
+TUKEY_K = 1.5
+MIN_HISTORY = 10
+MQC_METRICS = ["Number_of_frag", "Mean_length", "Percent_trimmed", "Percent_discarded",
+               "Percent_duplicates", "Q20_R1", "Q20_R2", "Percent_pdx_graft"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+  run_id TEXT PRIMARY KEY,
+  date TEXT,
+  version TEXT,
+  metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+  run_id TEXT,
+  sample_id TEXT,
+  sample_name TEXT,
+  PRIMARY KEY (run_id, sample_id)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+  run_id TEXT,
+  sample_id TEXT,
+  metric TEXT,
+  value REAL,
+  PRIMARY KEY (run_id, sample_id, metric)
+);
+CREATE INDEX IF NOT EXISTS metrics_value ON metrics (metric, value);
+CREATE TABLE IF NOT EXISTS histograms (
+  run_id TEXT,
+  sample_id TEXT,
+  name TEXT,
+  columns TEXT,
+  n_rows INTEGER,
+  data BLOB,
+  PRIMARY KEY (run_id, sample_id, name)
+);
+"""
+
+## Row ids of the trimming tables, ie. 'S1 [3-prime adapter]'
+TRIMMING_ID_RE = re.compile(r'^(.*) \[(.*)\]$')
+
+
+def get_options():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="SQLite database of the QC store")
+    subparsers = parser.add_subparsers(dest="command")
+
+    imp = subparsers.add_parser("import", help="Import the results of a run")
+    imp.add_argument("-r", "--run", required=True, help="Run id")
+    imp.add_argument("-s", "--stats", required=True, help="General metrics table (mq.stats)")
+    imp.add_argument("-t", "--trimming", nargs='*', default=[], help="Trimming tables (*_metrics.trim.tsv)")
+    imp.add_argument("--hist", nargs='*', default=[], help="Histogram files (<sample>_*.tsv)")
+    imp.add_argument("-m", "--metadata", default=None, help="Metadata file of the run (tab-separated key/value)")
+    imp.add_argument("-d", "--date", default=None, help="Date of the run (YYYY-MM-DD, default: today)")
+    imp.add_argument("-v", "--version", default="", help="Version of the pipeline")
+
+    perc = subparsers.add_parser("percentiles", help="Percentiles of a metric")
+    perc.add_argument("-m", "--metric", required=True, help="Metric name")
+    perc.add_argument("-p", "--percentiles", default=",".join(map(str, PERCENTILES)), help="Comma-separated percentiles")
+    perc.add_argument("--since", default=None, help="Only runs since this date (YYYY-MM-DD)")
+
+    trend = subparsers.add_parser("trend", help="Median of a metric per period")
+    trend.add_argument("-m", "--metric", required=True, help="Metric name")
+    trend.add_argument("--period", choices=["month", "year"], default="month", help="Period")
+
+    hist = subparsers.add_parser("histogram", help="Export a histogram of a sample")
+    hist.add_argument("-r", "--run", required=True, help="Run id")
+    hist.add_argument("-s", "--sample", required=True, help="Sample id")
+    hist.add_argument("-n", "--name", required=True, help="Histogram name, ie. 'R1_seqqual'")
+
+    out = subparsers.add_parser("outliers", help="Samples of a run outside the historical distribution")
+    out.add_argument("-r", "--run", required=True, help="Run id")
+    out.add_argument("-m", "--metrics", default=None, help="Comma-separated metrics (default: all metrics of the run)")
+    out.add_argument("-k", type=float, default=TUKEY_K, help="Tukey fences coefficient")
+    out.add_argument("--min_history", type=int, default=MIN_HISTORY, help="Minimum number of historical values of a metric")
+    out.add_argument("--mqc", default=None, help="Write the percentile of each value in a MultiQC table")
+    out.add_argument("--mqc_metrics", default=",".join(MQC_METRICS), help="Comma-separated metrics of the MultiQC table")
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error("a command is required")
+    return(args)
+
+
+def connect(db):
+    conn = sqlite3.connect(db, timeout=60)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_table(path, sep):
+    """
+    Rows of a table with a header, as a list of ordered dicts
+    """
+    with open(path) as f:
+        header = f.readline().rstrip('\n').split(sep)
+        return [OrderedDict(zip(header, line.rstrip('\n').split(sep))) for line in f if line.strip()]
+
+
+def read_stats(path):
+    """
+    Sample names and numeric metrics of the general metrics table, as a dict
+    {sample_id: (sample_name, {metric: value})}
+    """
+    samples = OrderedDict()
+    for row in read_table(path, ','):
+        sample = row.pop("Sample_id")
+        name = row.pop("Sample_name", "")
+        values = dict((k, to_float(v)) for k, v in row.items())
+        samples[sample] = (name, dict((k, v) for k, v in values.items() if v is not None))
+    return samples
+
+
+def read_trimming(path):
+    """
+    Numeric values of a trimming table, as a list of (sample_id, metric, value).
+    Metrics are named after the trimming step, ie. '3-prime adapter:Trimmed_reads'
+    """
+    values = []
+    for row in read_table(path, '\t'):
+        match = TRIMMING_ID_RE.match(row.pop("Sample_id"))
+        if match is None:
+            continue
+        sample, step = match.groups()
+        for col, value in row.items():
+            value = to_float(value)
+            if value is not None:
+                values.append((sample, "{}:{}".format(step, col), value))
+    return values
+
+
+def read_hist(path):
+    """
+    Columns of a histogram file, as (column names, list of columns). The first line
+    is a header if its first field is not a number.
+    """
+    with open(path) as f:
+        lines = [line.rstrip('\n').split('\t') for line in f if line.strip()]
+    if not lines:
+        return [], []
+    header = None
+    if to_float(lines[0][0]) is None:
+        header, lines = lines[0], lines[1:]
+    n_cols = len(lines[0]) if lines else len(header)
+    header = header or ["x"] + ["y{}".format(i) if i > 1 else "y" for i in range(1, n_cols)]
+    columns = [[to_float(fields[i]) if i < len(fields) else None for fields in lines] for i in range(n_cols)]
+    return header, columns
+
+
+def hist_sample(path, samples):
+    """
+    Sample of a histogram file '<sample>_<name>.tsv' (longest matching sample id), and the histogram name
+    """
+    base = os.path.basename(path)
+    base = base[:-4] if base.endswith('.tsv') else base
+    for sample in sorted(samples, key=len, reverse=True):
+        if base.startswith(sample + "_"):
+            return sample, base[len(sample) + 1:]
+    return None, None
+
+
+def pack_columns(columns):
+    """
+    Columns as a single blob of doubles, one column after the other (NaN for missing values)
+    """
+    data = array.array('d')
+    for col in columns:
+        data.extend(float('nan') if v is None else v for v in col)
+    return data.tobytes()
+
+
+def unpack_columns(blob, n_rows):
+    data = array.array('d')
+    data.frombytes(blob)
+    return [data[i:i + n_rows].tolist() for i in range(0, len(data), n_rows)] if n_rows else []
+
+
+def get_histogram(conn, run, sample, name):
+    """
+    Column names and columns of a stored histogram, or None
+    """
+    row = conn.execute("SELECT columns, n_rows, data FROM histograms WHERE run_id = ? AND sample_id = ? AND name = ?",
+                       (run, sample, name)).fetchone()
+    if row is None:
+        return None
+    return json.loads(row[0]), unpack_columns(row[2], row[1])
+
+
+def read_metadata(path):
+    metadata = OrderedDict()
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) >= 2 and fields[0]:
+                    metadata[fields[0]] = fields[1]
+    return metadata
+
+
+def import_run(conn, run, stats, trimming=(), hists=(), metadata=None, date=None, version=""):
+    """
+    Import the results of a run, in a single transaction. Previous results of the run are replaced.
+    """
+    samples = read_stats(stats)
+    with conn:
+        for table in ("runs", "samples", "metrics", "histograms"):
+            conn.execute("DELETE FROM {} WHERE run_id = ?".format(table), (run,))
+        conn.execute("INSERT INTO runs VALUES (?, ?, ?, ?)",
+                     (run, date or time.strftime("%Y-%m-%d"), version, json.dumps(read_metadata(metadata))))
+        conn.executemany("INSERT INTO samples VALUES (?, ?, ?)",
+                         [(run, sample, name) for sample, (name, values) in samples.items()])
+        conn.executemany("INSERT INTO metrics VALUES (?, ?, ?, ?)",
+                         [(run, sample, metric, value) for sample, (name, values) in samples.items()
+                          for metric, value in values.items()])
+        for path in [p for p in trimming if os.path.exists(p)]:
+            conn.executemany("INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?)",
+                             [(run, sample, metric, value) for sample, metric, value in read_trimming(path)])
+        for path in [p for p in hists if os.path.exists(p)]:
+            sample, name = hist_sample(path, samples)
+            if sample is None:
+                sys.stderr.write("Warning: no sample found for {}\n".format(path))
+                continue
+            header, columns = read_hist(path)
+            conn.execute("INSERT OR REPLACE INTO histograms VALUES (?, ?, ?, ?, ?, ?)",
+                         (run, sample, name, json.dumps(header), len(columns[0]) if columns else 0, pack_columns(columns)))
+    return len(samples)
+
+
+def history_filter(since=None, exclude_run=None):
+    """
+    SQL condition and parameters on the metrics table, for the runs since a date and/or without a run
+    """
+    cond, params = "", []
+    if since:
+        cond += " AND run_id IN (SELECT run_id FROM runs WHERE date >= ?)"
+        params.append(since)
+    if exclude_run:
+        cond += " AND run_id != ?"
+        params.append(exclude_run)
+    return cond, params
+
+
+def count_values(conn, metric, since=None, exclude_run=None):
+    cond, params = history_filter(since, exclude_run)
+    return conn.execute("SELECT COUNT(*) FROM metrics WHERE metric = ?" + cond, [metric] + params).fetchone()[0]
+
+
+def get_percentiles(conn, metric, percentiles, since=None, exclude_run=None):
+    """
+    Percentiles of a metric (nearest rank), each one read from the (metric, value) index
+    """
+    n = count_values(conn, metric, since, exclude_run)
+    if n == 0:
+        return OrderedDict((p, None) for p in percentiles)
+    cond, params = history_filter(since, exclude_run)
+    query = "SELECT value FROM metrics WHERE metric = ?" + cond + " ORDER BY value LIMIT 1 OFFSET ?"
+    values = OrderedDict()
+    for p in percentiles:
+        rank = min(max(int(round(p / 100. * (n - 1))), 0), n - 1)
+        values[p] = conn.execute(query, [metric] + params + [rank]).fetchone()[0]
+    return values
+
+
+def percentile_rank(conn, metric, value, exclude_run=None):
+    """
+    Percentage of the historical values of a metric lower than a value (ties count for half)
+    """
+    cond, params = history_filter(exclude_run=exclude_run)
+    lower, equal, n = conn.execute(
+        "SELECT SUM(value < ?), SUM(value = ?), COUNT(*) FROM metrics WHERE metric = ?" + cond,
+        [value, value, metric] + params).fetchone()
+    if not n:
+        return None
+    return 100. * (lower + 0.5 * equal) / n
+
+
+def get_trend(conn, metric, period="month"):
+    """
+    Number of values and median of a metric per period, as a list of (period, n, median)
+    """
+    length = 7 if period == "month" else 4
+    rows = conn.execute("SELECT substr(r.date, 1, ?), m.value FROM metrics m JOIN runs r ON r.run_id = m.run_id "
+                        "WHERE m.metric = ? ORDER BY 1, 2", (length, metric)).fetchall()
+    trend = OrderedDict()
+    for key, value in rows:
+        trend.setdefault(key, []).append(value)
+    return [(key, len(values), values[len(values) // 2]) for key, values in trend.items()]
+
+
+def find_outliers(conn, run, metrics=None, k=TUKEY_K, min_history=MIN_HISTORY):
+    """
+    Values of a run outside the Tukey fences [Q1 - k * IQR, Q3 + k * IQR] of the other runs,
+    as a list of ordered dicts
+    """
+    if metrics is None:
+        metrics = [m for m, in conn.execute("SELECT DISTINCT metric FROM metrics WHERE run_id = ? ORDER BY metric", (run,))]
+    outliers = []
+    for metric in metrics:
+        if count_values(conn, metric, exclude_run=run) < min_history:
+            continue
+        q1, q3 = get_percentiles(conn, metric, [25, 75], exclude_run=run).values()
+        low, high = q1 - k * (q3 - q1), q3 + k * (q3 - q1)
+        for sample, value in conn.execute("SELECT sample_id, value FROM metrics WHERE run_id = ? AND metric = ? "
+                                          "AND (value < ? OR value > ?) ORDER BY sample_id", (run, metric, low, high)):
+            outliers.append(OrderedDict([("Sample_id", sample), ("Metric", metric), ("Value", value),
+                                         ("Q1", q1), ("Q3", q3), ("Flag", "low" if value < low else "high")]))
+    return outliers
+
+
+def write_mqc_table(conn, run, metrics, outliers, output):
+    """
+    MultiQC table of the run: percentile of each value in the history, and the outlier metrics of each sample
+    """
+    flagged = OrderedDict()
+    for row in outliers:
+        flagged.setdefault(row["Sample_id"], []).append("{} ({})".format(row["Metric"], row["Flag"]))
+    metrics = [m for m in metrics if count_values(conn, m, exclude_run=run) > 0]
+    with open(output, 'w') as out:
+        out.write("\t".join(["Sample_id"] + ["{}_percentile".format(m) for m in metrics] + ["Outliers"]) + "\n")
+        for sample, in conn.execute("SELECT sample_id FROM samples WHERE run_id = ? ORDER BY sample_id", (run,)):
+            values = []
+            for metric in metrics:
+                row = conn.execute("SELECT value FROM metrics WHERE run_id = ? AND sample_id = ? AND metric = ?",
+                                   (run, sample, metric)).fetchone()
+                rank = percentile_rank(conn, metric, row[0], exclude_run=run) if row else None
+                values.append("{:.1f}".format(rank) if rank is not None else "NA")
+            out.write("\t".join([sample] + values + [", ".join(flagged.get(sample, [])) or "None"]) + "\n")
+
+
+def format_value(value):
+    return "NA" if value is None else "{:g}".format(value)
+
+
+if __name__ == '__main__':
+    args = get_options()
+    conn = connect(args.db)
+
+    if args.command == "import":
+        if not os.path.exists(args.stats):
+            sys.stderr.write("{} file not found\n".format(args.stats))
+            sys.exit(1)
+        n = import_run(conn, args.run, args.stats, trimming=args.trimming, hists=args.hist, metadata=args.metadata,
+                       date=args.date, version=args.version)
+        sys.stderr.write("{} samples imported for run {}\n".format(n, args.run))
+
+    elif args.command == "percentiles":
+        percentiles = [float(p) for p in args.percentiles.split(',')]
+        values = get_percentiles(conn, args.metric, percentiles, since=args.since)
+        print("\t".join(["Metric", "N"] + ["P{:g}".format(p) for p in percentiles]))
+        print("\t".join([args.metric, str(count_values(conn, args.metric, since=args.since))] + [format_value(v) for v in values.values()]))
+
+    elif args.command == "trend":
+        print("\t".join(["Period", "N", "Median"]))
+        for period, n, median in get_trend(conn, args.metric, period=args.period):
+            print("\t".join([period, str(n), format_value(median)]))
+
+    elif args.command == "histogram":
+        hist = get_histogram(conn, args.run, args.sample, args.name)
+        if hist is None:
+            sys.stderr.write("No histogram {} for sample {} of run {}\n".format(args.name, args.sample, args.run))
+            sys.exit(1)
+        header, columns = hist
+        print("\t".join(header))
+        for values in zip(*columns):
+            print("\t".join(format_value(v) for v in values))
+
+    elif args.command == "outliers":
+        metrics = args.metrics.split(',') if args.metrics else None
+        outliers = find_outliers(conn, args.run, metrics=metrics, k=args.k, min_history=args.min_history)
+        print("\t".join(["Sample_id", "Metric", "Value", "Q1", "Q3", "Flag"]))
+        for row in outliers:
+            print("\t".join(format_value(v) if isinstance(v, float) else str(v) for v in row.values()))
+        if args.mqc:
+            write_mqc_table(conn, args.run, args.mqc_metrics.split(','), outliers, args.mqc)
+
+    conn.close()
@@ -2,23 +2,30 @@
 import os
 import argparse
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-i", "--input", help="version file", type=str, default='')
-args = parser.parse_args()
-
-versions = {}
-with open(args.input) as f:
-    for line in f:
-        if line.strip():
-            (key, val) = line.strip().split()
-            if key in versions.keys():
-                if val != versions[str(key)]:
-                    versions[str(key)] = versions[str(key)] + " - " + val
-            else:
-                versions[str(key)] = val
-
-# Dump to YAML
-print ('''
+
+def get_options(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help="version file", type=str, default='')
+    args = parser.parse_args(argv)
+    return(args)
+
+
+def main(argv=None):
+    args = get_options(argv)
+
+    versions = {}
+    with open(args.input) as f:
+        for line in f:
+            if line.strip():
+                (key, val) = line.strip().split()
+                if key in versions.keys():
+                    if val != versions[str(key)]:
+                        versions[str(key)] = versions[str(key)] + " - " + val
+                else:
+                    versions[str(key)] = val
+
+    # Dump to YAML
+    print ('''
 id: 'software_versions'
 section_name: 'Software Versions'
 section_href: 'https://gitlab.curie.fr/rnaseq'
@@ -27,6 +34,10 @@ description: 'are collected at run time from the software output.'
 data: |
     <dl class="dl-horizontal">
 ''')
-for k,v in versions.items():
-    print("        <dt>{}</dt><dd><samp>{}</samp></dd>".format(k,v))
-print ("    </dl>")
+    for k,v in versions.items():
+        print("        <dt>{}</dt><dd><samp>{}</samp></dd>".format(k,v))
+    print ("    </dl>")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+#############################################################################################
+# Copyright Institut Curie 2022                                                             #
+#                                                                                           #
+# This software is a computer program whose purpose                                         #
+# is to analyze high-throughput sequencing data.                                            #
+# You can use, modify and/ or redistribute the software under                               #
+# the terms of license (see the LICENSE file for more details).                             #
+# The software is distributed in the hope that it will be useful,                           #
+# but "AS IS" WITHOUT ANY WARRANTY OF ANY KIND.                                             #
+# Users are therefore encouraged to test the software's suitabilityas regards               #
+# their requirements in conditions enabling the security of their systems and/or data.      #
+# The fact that you are presently reading this means that                                   #
+# you have had knowledge of the license and that you accept its terms.                      #
+#############################################################################################
+
+"""
+Fixed-size sketches used to estimate the library complexity from the read sequences.
+Reads (or pairs of reads) are identified by a 64 bits hash of their first bases.
+- HyperLogLog: number of distinct fragments (64 kB, ~0.4% standard error)
+- Count-min sketch: copy number of the most duplicated fragment (2 MB). It is an
+  upper bound: collisions add up to about n_frag / CMS_WIDTH copies, which dominate
+  the value of deep libraries without highly duplicated fragments.
+All sketches can be merged.
+"""
+
+import math
+import numpy as np
+
+## Number of bases used to identify a read (multiple of 8)
+PREFIX_LENGTH = 48
+
+HLL_PRECISION = 16
+CMS_DEPTH = 4
+CMS_WIDTH = 2 ** 17
+## Most duplicated fragments kept to find the highest count of merged sketches
+CMS_CANDIDATES = 32
+
+## Saturation curve points are recorded each time the number of fragments grows by this factor
+SATURATION_STEP = 1.25
+SATURATION_START = 1000
+
+GOLDEN = 0x9E3779B97F4A7C15
+GOLDEN64 = np.uint64(GOLDEN)
+
+
+def mix64(h):
+    """
+    SplitMix64 finalizer, applied to an array of uint64
+    """
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def hash_prefixes(matrix, lengths):
+    """
+    Hash the rows of a (reads x PREFIX_LENGTH) uint8 matrix, padded with null characters.
+    The rows are read as 64 bits words. The length of the read is used as seed.
+    """
+    words = np.ascontiguousarray(matrix).view(np.uint64)
+    h = mix64(lengths.astype(np.uint64) + GOLDEN64)
+    for i in range(words.shape[1]):
+        h = mix64(h ^ words[:, i])
+    return h
+
+
+def hash_pairs(h1, h2):
+    """
+    Combine the hashes of R1 and R2 reads into a fragment hash
+    """
+    return mix64(h1 * GOLDEN64 + h2)
+
+
+def sigma(x):
+    if x == 1.:
+        return float('inf')
+    y = 1.
+    z = x
+    while True:
+        x = x * x
+        z_old = z
+        z += x * y
+        y += y
+        if z == z_old:
+            return z
+
+
+def tau(x):
+    if x == 0. or x == 1.:
+        return 0.
+    y = 1.
+    z = 1. - x
+    while True:
+        x = math.sqrt(x)
+        z_old = z
+        y *= 0.5
+        z -= (1. - x) ** 2 * y
+        if z == z_old:
+            return z / 3.
+
+
+class HyperLogLog(object):
+    """
+    HyperLogLog with 2^p one byte registers.
+    The cardinality is computed with the improved estimator of Ertl (2017),
+    which does not need empirical bias correction.
+    """
+
+    def __init__(self, p=HLL_PRECISION):
+        self.p = p
+        self.registers = np.zeros(2 ** p, dtype=np.uint8)
+
+    def update(self, hashes):
+        q = 64 - self.p
+        index = (hashes >> np.uint64(q)).astype(np.int64)
+        ## rank of the first 1 bit of the remaining q bits (q + 1 if all bits are 0)
+        rest = (hashes & np.uint64((1 << q) - 1)).astype(np.float64)
+        rank = (q + 1 - np.frexp(rest)[1]).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    @property
+    def relative_error(self):
+        """
+        Standard error of the cardinality, relative to the cardinality (lower for small sets)
+        """
+        return 1.04 / math.sqrt(self.registers.size)
+
+    def cardinality(self):
+        m = self.registers.size
+        q = 64 - self.p
+        counts = np.bincount(self.registers, minlength=q + 2)
+        if counts[0] == m:
+            return 0.
+        z = m * tau(1. - counts[q + 1] / m)
+        for k in range(q, 0, -1):
+            z = 0.5 * (z + counts[k])
+        z += m * sigma(counts[0] / m)
+        return m * m / (2. * math.log(2.) * z)
+
+
+class CountMinSketch(object):
+    """
+    Count-min sketch of the fragments. Counts can only be over-estimated.
+    The hashes of the most duplicated fragments are kept as candidates, so that
+    the highest count of merged sketches can be estimated again.
+    """
+
+    def __init__(self, depth=CMS_DEPTH, width=CMS_WIDTH):
+        self.table = np.zeros((depth, width), dtype=np.uint32)
+        self.max_count = 0
+        self.candidates = np.zeros(0, dtype=np.uint64)
+
+    def columns(self, hashes, row):
+        seed = np.uint64(((row + 1) * GOLDEN) % 2 ** 64)
+        return (mix64(hashes + seed) % np.uint64(self.table.shape[1])).astype(np.int64)
+
+    def estimate(self, hashes):
+        estimates = None
+        for row in range(self.table.shape[0]):
+            counts = self.table[row, self.columns(hashes, row)]
+            estimates = counts if estimates is None else np.minimum(estimates, counts)
+        return estimates
+
+    def keep_candidates(self, hashes, estimates):
+        hashes, index = np.unique(np.concatenate([self.candidates, hashes]), return_index=True)
+        estimates = np.concatenate([self.estimate(self.candidates), estimates])[index] if self.candidates.size else estimates[index]
+        if hashes.size > CMS_CANDIDATES:
+            top = np.argpartition(estimates, -CMS_CANDIDATES)[-CMS_CANDIDATES:]
+            hashes, estimates = hashes[top], estimates[top]
+        self.candidates = hashes
+        return estimates
+
+    def update(self, hashes):
+        """
+        Add the fragments, and update the highest count of the fragments seen so far
+        """
+        width = self.table.shape[1]
+        for row in range(self.table.shape[0]):
+            self.table[row] += np.bincount(self.columns(hashes, row), minlength=width).astype(np.uint32)
+        estimates = self.estimate(hashes)
+        if estimates.size > 0:
+            self.max_count = max(self.max_count, int(estimates.max()))
+            top = np.argpartition(estimates, -CMS_CANDIDATES)[-CMS_CANDIDATES:] if estimates.size > CMS_CANDIDATES else slice(None)
+            self.keep_candidates(hashes[top], estimates[top])
+
+    def merge(self, other):
+        self.table += other.table
+        self.max_count = max(self.max_count, other.max_count)
+        if other.candidates.size > 0:
+            estimates = self.keep_candidates(other.candidates, self.estimate(other.candidates))
+            self.max_count = max(self.max_count, int(estimates.max()))
+        return self
+
+
+class ComplexitySketch(object):
+    """
+    Number of fragments, distinct fragments, highest duplication level,
+    and saturation curve (number of distinct fragments versus number of fragments)
+    """
+
+    def __init__(self):
+        self.n_frag = 0
+        self.hll = HyperLogLog()
+        self.cms = CountMinSketch()
+        self.saturation = []
+        self.next_point = SATURATION_START
+
+    def update(self, hashes):
+        if hashes.size == 0:
+            return
+        self.hll.update(hashes)
+        self.cms.update(hashes)
+        self.n_frag += hashes.size
+        if self.n_frag >= self.next_point:
+            self.saturation.append((self.n_frag, self.distinct))
+            self.next_point = self.n_frag * SATURATION_STEP
+
+    def merge(self, other):
+        """
+        Merge the sketch of another part of the data. The number of distinct fragments
+        is the one of the whole data, but the highest duplication level is only a lower
+        bound (fragments duplicated across the parts may not be candidates of any part),
+        and the saturation curve is dropped. The files used for the library complexity
+        are therefore not split (see fastq_metrics.py).
+        """
+        self.n_frag += other.n_frag
+        self.hll.merge(other.hll)
+        self.cms.merge(other.cms)
+        self.saturation = []
+        return self
+
+    def to_dict(self):
+        """
+        State of the sketch, as numbers and numpy arrays
+        """
+        return dict(n_frag=self.n_frag, next_point=self.next_point, saturation=self.saturation,
+                    hll=self.hll.registers, cms=self.cms.table, max_count=self.cms.max_count,
+                    candidates=self.cms.candidates)
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls()
+        sketch.n_frag = int(state["n_frag"])
+        sketch.next_point = state["next_point"]
+        sketch.saturation = [tuple(point) for point in state["saturation"]]
+        sketch.hll.registers = np.asarray(state["hll"], dtype=np.uint8)
+        sketch.cms.table = np.asarray(state["cms"], dtype=np.uint32)
+        sketch.cms.max_count = int(state["max_count"])
+        sketch.cms.candidates = np.asarray(state["candidates"], dtype=np.uint64)
+        return sketch
+
+    @property
+    def distinct(self):
+        return min(int(round(self.hll.cardinality())), self.n_frag)
+
+    @property
+    def duplicates_ci(self):
+        """
+        Half width of the 95% confidence interval of the percentage of duplicates
+        """
+        if self.n_frag == 0:
+            return None
+        return 1.96 * self.hll.relative_error * self.distinct * 100. / self.n_frag
+
+    @property
+    def max_duplication(self):
+        return self.cms.max_count
+
+    def saturation_curve(self):
+        points = list(self.saturation)
+        if self.n_frag > 0 and (not points or points[-1][0] != self.n_frag):
+            points.append((self.n_frag, self.distinct))
+        return points
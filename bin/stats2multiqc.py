@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+
+
+#############################################################################################
+# Copyright Institut Curie 2022                                                             #
+#                                                                                           #
+# This software is a computer program whose purpose                                         #
+# is to analyze high-throughput sequencing data.                                            #
+# You can use, modify and/ or redistribute the software under                               #
+# the terms of license (see the LICENSE file for more details).                             #
+# The software is distributed in the hope that it will be useful,                           #
+# but "AS IS" WITHOUT ANY WARRANTY OF ANY KIND.                                             #
+# Users are therefore encouraged to test the software's suitabilityas regards               #
+# their requirements in conditions enabling the security of their systems and/or data.      #
+# The fact that you are presently reading this means that                                   #
+# you have had knowledge of the license and that you accept its terms.                      #
+#############################################################################################
+
+"""
+Aggregate the per-sample statistics (general metrics, xengsort, Q20)
+in a single table for MultiQC.
+Q20 is computed from FastQC results on trimmed reads if available,
+or from the per sequence quality scores computed by fastq_metrics.py.
+Each input file is read once.
+The xengsort counts are read from the summaries of xengsort_stream.py (*_xengsort.json),
+or parsed from the xengsort logs.
+With --fragments, the general metrics, per sequence quality scores and trimming rows
+are merged from the pre-parsed JSON fragments of the samples (*.fragment.json, written
+by fastq_metrics.py and trimming_report.py) instead of the per-sample files, and the
+trimming tables are written with the general metrics table. FastQC zip files are then
+only read for the samples whose Q20 counts are not in the cache (--cache). The fragments
+of all samples are still merged at each run.
+With --perf_dir, the performance statistics of the pipeline scripts (*.perf.json,
+see perf_stats.py) are also aggregated in a 'Pipeline performance' table.
+"""
+
+import io
+import os
+import glob
+import json
+import zipfile
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from perf_stats import PerfRecorder, file_size, load_perf_files, write_perf_table
+from trimming_report import write_combined_summary
+
+STATS_HEADER = ["Sample_id", "Number_of_frag", "Mean_length", "Total_base", "Trimmed_Mean_length",
+                "Number_trimmed", "Percent_trimmed", "Number_discarded", "Percent_discarded"]
+QUAL_THRESHOLD = 20
+
+
+def get_options(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("splan", help="Sample plan")
+    parser.add_argument("is_pe", help="1 for paired-end data, 0 for single-end data")
+    parser.add_argument("-s", "--stats_dir", default="trimming", help="Directory with the *_stats.trim.csv files")
+    parser.add_argument("-f", "--fastqc_dir", default="fastqc_trimmed", help="Directory with the FastQC zip files")
+    parser.add_argument("-x", "--xengsort_dir", default="xengsort", help="Directory with the xengsort summaries or logs")
+    parser.add_argument("-o", "--output", default="mq.stats", help="Output file")
+    parser.add_argument("-p", "--threads", type=int, default=4, help="Number of threads used to read the FastQC zip files")
+    parser.add_argument("--fragments", default=None, help="Directory with the *.fragment.json files of the samples")
+    parser.add_argument("--trimming_prefix", default="all", help="Prefix of the trimming tables merged from the fragments")
+    parser.add_argument("--cache", default=None, help="Directory of the persistent cache of results")
+    parser.add_argument("--cache_size", type=int, default=1024, help="Maximum size of the cache (MB)")
+    parser.add_argument("--no_cache", action="store_true", help="Do not use the cache")
+    parser.add_argument("--perf_dir", default=None, help="Directory with the *.perf.json files of the pipeline scripts")
+    parser.add_argument("--perf_output", default="pipeline_performance.tsv", help="Output file of the performance table")
+    args = parser.parse_args(argv)
+    return(args)
+
+
+def load_sample_plan(splan):
+    """
+    Sample plan as an ordered dict {sample_id: sample_name}
+    """
+    samples = OrderedDict()
+    with open(splan) as f:
+        for line in f:
+            if line.strip():
+                row = line.rstrip('\n').split(',')
+                samples[row[0]] = row[1].strip() if len(row) > 1 else ''
+    return samples
+
+
+def load_stats(stats_dir):
+    """
+    Read all *_stats.trim.csv files, return a dict {sample_id: ordered dict of values}
+    """
+    stats = {}
+    for path in glob.glob(os.path.join(stats_dir, "*stats.trim.csv")):
+        with open(path) as f:
+            header = f.readline().strip().split(',')
+            values = f.readline().strip().split(',')
+        if values and values[0]:
+            stats[values[0]] = OrderedDict(zip(header, values))
+    return stats
+
+
+def load_fragments(fragments_dir):
+    """
+    Read all *.fragment.json files. Return the general metrics fragments as a dict
+    {sample_id: fragment}, and the trimming rows as a dict {sample_id: {table: rows}}
+    """
+    general, trimming = {}, {}
+    for path in sorted(glob.glob(os.path.join(fragments_dir, "*.fragment.json"))):
+        with open(path) as f:
+            fragment = json.load(f, object_pairs_hook=OrderedDict)
+        if fragment.get("type") == "general":
+            general[fragment["sample"]] = fragment
+        elif fragment.get("type") == "trimming":
+            trimming[fragment["sample"]] = fragment["tables"]
+    return general, trimming
+
+
+def parse_xengsort_log(log):
+    """
+    Number of reads per class from a xengsort classification log
+    """
+    header = None
+    with open(log) as f:
+        for line in f:
+            if '#' in line or not line.strip():
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if fields[0] == 'prefix':
+                header = fields[1:]
+                continue
+            return OrderedDict(zip(header or ["host", "graft"], [int(x) for x in fields[1:]]))
+    return None
+
+
+def get_xengsort_counts(xengsort_dir, sample):
+    """
+    Number of reads per class of a sample, from its xengsort_stream.py summary
+    if available, otherwise from its xengsort log
+    """
+    summary = os.path.join(xengsort_dir, "{}_xengsort.json".format(sample))
+    if os.path.exists(summary):
+        with open(summary) as f:
+            return json.load(f, object_pairs_hook=OrderedDict)["counts"]
+    xlog = os.path.join(xengsort_dir, "{}_xengsort.log".format(sample))
+    if os.path.exists(xlog):
+        return parse_xengsort_log(xlog)
+    return None
+
+
+def get_fastqc_qual_counts(zip_file):
+    """
+    Stream the 'Per sequence quality scores' module out of a FastQC zip file.
+    Return the number of reads with a mean quality >= QUAL_THRESHOLD.
+    """
+    with zipfile.ZipFile(zip_file) as z:
+        member = next(name for name in z.namelist() if name.endswith('fastqc_data.txt'))
+        with z.open(member) as raw:
+            in_module = False
+            count = 0
+            for line in io.TextIOWrapper(raw, encoding='utf-8'):
+                if line.startswith('>>Per sequence quality scores'):
+                    in_module = True
+                elif in_module and line.startswith('>>END_MODULE'):
+                    break
+                elif in_module and line[:1].isdigit():
+                    qual, value = line.rstrip('\n').split('\t')[:2]
+                    if qual.isdigit() and int(qual) >= QUAL_THRESHOLD:
+                        count += float(value)
+    return count
+
+
+def get_seqqual_counts(seqqual_file):
+    """
+    Number of reads with a mean quality >= QUAL_THRESHOLD, from a fastq_metrics.py
+    per sequence quality file
+    """
+    count = 0
+    with open(seqqual_file) as f:
+        for line in f:
+            qual, value = line.rstrip('\n').split('\t')[:2]
+            if qual.isdigit() and int(qual) >= QUAL_THRESHOLD:
+                count += float(value)
+    return count
+
+
+def get_qual_counts(path):
+    return get_fastqc_qual_counts(path) if path.endswith('.zip') else get_seqqual_counts(path)
+
+
+def count_qual_files(paths, threads=4, cache=None):
+    """
+    Number of reads with a mean quality >= QUAL_THRESHOLD of each file, as a dict {path: count}.
+    Files which are not in the cache are read concurrently.
+    """
+    counts, keys = {}, {}
+    for path in paths:
+        if cache is not None:
+            keys[path] = cache.key("qual_counts", [path], {"threshold": QUAL_THRESHOLD})
+            value = cache.get(keys[path])
+            if value is not None:
+                counts[path] = value
+    jobs = [path for path in paths if path not in counts]
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as pool:
+        for path, value in zip(jobs, pool.map(get_qual_counts, jobs)):
+            counts[path] = value
+            if cache is not None:
+                cache.put(keys[path], value)
+    return counts
+
+
+def get_fragment_qual_counts(fragment, is_pe):
+    """
+    Number of reads with a mean quality >= QUAL_THRESHOLD, from the per sequence
+    quality scores of a general metrics fragment, as a list of (column, count).
+    As for the files, both reads are required for paired-end data.
+    """
+    seqqual = fragment.get("seqqual", {})
+    if list(seqqual) != ["R1", "R2"] and not (is_pe == "0" and list(seqqual) == ["R1"]):
+        return []
+    return [("Q20_" + read, sum(float(n) for qual, n in hist if qual >= QUAL_THRESHOLD))
+            for read, hist in seqqual.items()]
+
+
+def percent(value, total):
+    if not total:
+        return 'NA'
+    return "{:.2f}".format(value * 100 / total)
+
+
+def get_qual_files(sample, fastqc_dir, stats_dir, is_pe):
+    """
+    Per sequence quality files of the trimmed reads of a sample, as a list of (column, path).
+    FastQC zip files are used first, then fastq_metrics.py outputs.
+    """
+    for directory, single, r1, r2 in [
+            (fastqc_dir, "{}_fastqc.zip", "{}_1_fastqc.zip", "{}_2_fastqc.zip"),
+            (stats_dir, "{}_seqqual.tsv", "{}_R1_seqqual.tsv", "{}_R2_seqqual.tsv")]:
+        single, r1, r2 = [os.path.join(directory, f.format(sample)) for f in (single, r1, r2)]
+        if is_pe == "0" and os.path.exists(single):
+            return [("Q20_R1", single)]
+        elif os.path.exists(r1) and os.path.exists(r2):
+            return [("Q20_R1", r1), ("Q20_R2", r2)]
+    return []
+
+
+def get_qual_columns(samples, fastqc_dir, stats_dir, is_pe, threads=4, fragments=None, cache=None):
+    """
+    Number of reads with a mean quality >= QUAL_THRESHOLD of each sample, as a dict
+    {sample_id: [(column, count)]}. FastQC zip files are used first, then the fragments
+    of the samples if any, or the fastq_metrics.py per sequence quality files.
+    """
+    qual_files = {}
+    for sample in samples:
+        files = get_qual_files(sample, fastqc_dir, stats_dir, is_pe)
+        if fragments is not None:
+            files = [(col, path) for col, path in files if path.endswith('.zip')]
+        qual_files[sample] = files
+    counts = count_qual_files([path for files in qual_files.values() for col, path in files], threads=threads, cache=cache)
+
+    columns = {}
+    for sample, files in qual_files.items():
+        if files:
+            columns[sample] = [(col, counts[path]) for col, path in files]
+        elif fragments is not None and sample in fragments:
+            columns[sample] = get_fragment_qual_counts(fragments[sample], is_pe)
+    return columns
+
+
+def aggregate(samples, stats, qual_columns, xengsort_dir):
+    """
+    Build the rows of the MultiQC table, one per sample of the sample plan
+    """
+    n_total = sum(int(s["Number_of_frag"]) for s in stats.values() if s.get("Number_of_frag", "NA").isdigit())
+
+    rows = []
+    for sample, sname in samples.items():
+        if sample not in stats:
+            continue
+        row = OrderedDict(stats[sample])
+        n_frag = int(row["Number_of_frag"]) if row["Number_of_frag"].isdigit() else 0
+        row["Sample_name"] = sname
+        row["Sample_representation"] = percent(n_frag, n_total)
+
+        ## PDX
+        counts = get_xengsort_counts(xengsort_dir, sample)
+        if counts is not None:
+            row["Number_pdx_host"] = counts["host"]
+            row["Percent_pdx_host"] = percent(counts["host"], n_frag)
+            row["Number_pdx_graft"] = counts["graft"]
+            row["Percent_pdx_graft"] = percent(counts["graft"], n_frag)
+            if "ambiguous" in counts:
+                row["Number_pdx_ambiguous"] = counts["ambiguous"]
+                row["Percent_pdx_ambiguous"] = percent(counts["ambiguous"], n_frag)
+
+        ## Q20
+        for col, count in qual_columns.get(sample, []):
+            row[col] = percent(count, n_frag)
+        rows.append(row)
+    return rows
+
+
+def merge_trimming_tables(samples, trimming, oprefix):
+    """
+    Write the trimming rows of all samples, in the order of the sample plan,
+    in a single table per trimming tool
+    """
+    order = [sample for sample in samples if sample in trimming] + sorted(set(trimming) - set(samples))
+    tables = OrderedDict()
+    for sample in order:
+        for table, rows in trimming[sample].items():
+            tables.setdefault(table, []).extend(rows)
+    for table, rows in tables.items():
+        write_combined_summary(rows, oprefix=oprefix, table=table)
+
+
+def write_table(rows, output):
+    """
+    Write the MultiQC table. Columns missing for some samples are set to 'NA'.
+    """
+    header = list(STATS_HEADER)
+    for row in rows:
+        header += [col for col in row if col not in header]
+    with open(output, 'w') as out:
+        out.write(",".join(header) + "\n")
+        for row in rows:
+            out.write(",".join(str(row.get(col, 'NA')) for col in header) + "\n")
+
+
+def main(argv=None):
+    args = get_options(argv)
+    perf = PerfRecorder("stats2multiqc")
+
+    cache = None
+    if args.cache and not args.no_cache:
+        from qc_cache import ResultCache, source_version
+        cache = ResultCache(args.cache, version=source_version([__file__]), max_size=args.cache_size * 1024 * 1024)
+
+    with perf.stage("load") as st:
+        samples = load_sample_plan(args.splan)
+        fragments = trimming = None
+        if args.fragments:
+            fragments, trimming = load_fragments(args.fragments)
+            stats = dict((sample, fragment["stats"]) for sample, fragment in fragments.items())
+            st.add(bytes_read=file_size(glob.glob(os.path.join(args.fragments, "*.fragment.json"))), records=len(stats))
+        else:
+            stats = load_stats(args.stats_dir)
+            st.add(bytes_read=file_size(glob.glob(os.path.join(args.stats_dir, "*stats.trim.csv"))), records=len(stats))
+
+    with perf.stage("aggregate") as st:
+        qual_columns = get_qual_columns([sample for sample in samples if sample in stats], fastqc_dir=args.fastqc_dir,
+                                        stats_dir=args.stats_dir, is_pe=args.is_pe, threads=args.threads,
+                                        fragments=fragments, cache=cache)
+        rows = aggregate(samples, stats, qual_columns, xengsort_dir=args.xengsort_dir)
+        st.add(records=len(rows))
+
+    with perf.stage("write"):
+        write_table(rows, args.output)
+        if trimming:
+            merge_trimming_tables(samples, trimming, oprefix=args.trimming_prefix)
+
+    ## Statistics of this script are added to the ones of the pipeline tasks
+    if args.perf_dir:
+        records = load_perf_files(args.perf_dir)
+        if perf.enabled:
+            records.append(perf.to_dict())
+        write_perf_table(records, args.perf_output)
+
+
+if __name__ == '__main__':
+    main()
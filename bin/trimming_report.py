@@ -1,25 +1,67 @@
 #!/usr/bin/env python
 
-import numpy as np
 import re
 import os
+import sys
 import json
-import gzip
 import argparse
-from Bio import SeqIO
+from collections import OrderedDict
 
-def get_options():
+from perf_stats import PerfRecorder, file_size
+
+
+def get_options(argv=None):
     parser = argparse.ArgumentParser()
-    parser.add_argument('logs', nargs='+', help="Logs file(s)")
-    parser.add_argument("-u", "--trim_tool", default="", help="specifies adapter trimming tool ['trimgalore','fastp'].")
+    parser.add_argument('logs', nargs='*', help="Logs file(s)")
+    parser.add_argument("-u", "--trim_tool", default="", help="specifies adapter trimming tool ['trimgalore','cutadapt','fastp']. Fastp statistics are read from its JSON report(s)")
     parser.add_argument("-t", "--atype", default="Adapter", help="Adapter type")
     parser.add_argument("-n", "--name", default="", help="")
     parser.add_argument("-o", "--oprefix", default="")
-    args = parser.parse_args()
+    parser.add_argument("-m", "--manifest", default=None,
+                        help="Batch mode. Tab-separated file with one trimming step per line: sample name, trimming tool, adapter type, output prefix, comma-separated logs")
+    parser.add_argument("-c", "--combined", action="store_true",
+                        help="Write all samples in a single table per trimming tool, named after --oprefix")
+    parser.add_argument("-f", "--fragments", action="store_true",
+                        help="Also write the rows of each sample in a JSON fragment (<sample>.trimming.fragment.json) for the MultiQC report")
+    parser.add_argument("--cache", default=None, help="Directory of the persistent cache of results")
+    parser.add_argument("--cache_size", type=int, default=1024, help="Maximum size of the cache (MB)")
+    parser.add_argument("--no_cache", action="store_true", help="Do not use the cache")
+    args = parser.parse_args(argv)
+    if args.manifest is None and not args.logs:
+        parser.error("logs file(s) or --manifest are required")
     return(args)
 
 
+## Lines of the trimgalore/cutadapt logs which are parsed, after stripping.
+## Indented 'Read 1:' / 'Read 2:' lines are attached to the previous field.
+LOG_PREFIXES = (
+    'Adapter sequence:',
+    'Sequence:',
+    'Reads with adapters:',
+    'Read 1 with adapter:',
+    'Read 2 with adapter:',
+    'Reads that were too short:',
+    'Pairs that were too short:',
+    'Total basepairs processed:',
+    'Quality-trimmed:',
+    'Total written (filtered):',
+    'Sequences removed',
+    'Number of sequence pairs removed',
+    'Read 1:',
+    'Read 2:'
+)
+READ_PREFIXES = ('Read 1:', 'Read 2:')
+
+## Top-level sections of the fastp JSON report which are loaded
+FASTP_SECTIONS = ('summary', 'filtering_result', 'adapter_cutting', 'polyx_trimming')
+
+PERCENT_RE = re.compile(r'\(\s*([0-9.]+)%\)')
+INT_RE = re.compile(r'[0-9][0-9,]*')
+
+
 def simplify(s):
+    if s is None:
+        return 'NA'
     if len(s) > 100:
         output=''
         counts=1
@@ -41,53 +83,89 @@ def simplify(s):
     else:
         return s
 
- 
+
+def parse_log(log):
+    """
+    Read a trimgalore/cutadapt log file once.
+    Return a dict with the values (text after the first ':') of all lines starting with one of LOG_PREFIXES.
+    """
+    fields = {}
+    section = None
+    with open(log) as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith(LOG_PREFIXES):
+                continue
+            for prefix in LOG_PREFIXES:
+                if line.startswith(prefix):
+                    break
+            if prefix in READ_PREFIXES:
+                key = section + '/' + prefix if section is not None else prefix
+            else:
+                key = section = prefix
+            fields.setdefault(key, []).append(line.split(':', 1)[1].strip())
+    return fields
+
+
+def get_first(fields, key):
+    values = fields.get(key)
+    return values[0] if values else None
+
+
+def get_percent(value, default=None):
+    """
+    Extract the percentage from a 'count (xx.x%)' log value
+    """
+    if value is None:
+        return default
+    return float(PERCENT_RE.search(value).group(1))
+
+
+def get_int(value):
+    """
+    Extract the first (comma-formatted) integer from a log value
+    """
+    if value is None:
+        return None
+    return int(INT_RE.search(value).group().replace(',', ''))
+
+
+def get_adapter(fields):
+    """
+    Adapter sequence from trimgalore header or from the first cutadapt adapter section
+    """
+    adapter_seq = get_first(fields, 'Adapter sequence:')
+    if adapter_seq is not None:
+        return adapter_seq.replace("'", "")
+    adapter_seq = get_first(fields, 'Sequence:')
+    if adapter_seq is not None:
+        return adapter_seq.split(';')[0].strip()
+    return None
+
+
 def get_trimgalore_summary(logs, sample_name):
     """"
     Extract statistics from trimGalore logs file
     For paired-end data, trimgalore generates 2 log files (one per read)
     """
-    base = os.path.basename(logs[0])
-    adapter_seq = trimmed_reads = None
-    qual_reads = too_short = 0
-    stats_list=()
- 
-    with open(logs[0]) as f:
-        for i, line in enumerate(f):
-            if re.findall('Adapter sequence', line) and adapter_seq is None:
-                adapter_seq = re.search('Adapter sequence:[^"]*',line).group().split(':')[1].strip()#.split('(')[0].strip()
-                adapter_seq = re.sub("'","",adapter_seq)
-            if re.findall('Sequence:[^"]*', line) and adapter_seq is None:
-                adapter_seq = re.search('Sequence:[^"]*',line).group().split(';')[0].split(':')[1].strip()
-            if re.findall('Quality-trimmed:[^"]', line):
-                qual_reads = float(re.search('Quality-trimmed:[^"]*',line).group().strip().split('(')[1].split(')')[0].split('%')[0])
-            if re.findall('Reads with adapters', line.strip()):
-                trimmed_reads = float(re.search('Reads with adapters:[^"]*',line).group().strip().split('(')[1].split(')')[0].split('%')[0])
-            if re.findall('Sequences removed', line.strip()):
-                too_short = float(re.search('^Sequences removed [\$|\W|\s|\S|\w]*',line).group().strip().split(':')[1].split('(')[1].split(')')[0].split('%')[0])
+    fields = parse_log(logs[0])
+    adapter_seq = get_adapter(fields)
+    trimmed_reads = get_percent(get_first(fields, 'Reads with adapters:'))
+    qual_reads = get_percent(get_first(fields, 'Quality-trimmed:'), 0)
+    too_short = get_percent(get_first(fields, 'Sequences removed'), 0)
     stats_list=[qual_reads, trimmed_reads, too_short]
     out_list = dict(sample_name = sample_name, adapter = simplify(adapter_seq), stat = stats_list)
 
     if len(logs)==2:
-        adapter_seq_2 = trimmed_reads_2 = 'NA'
-        qual_reads_2 = 0
-        adapter_seq_2 = None
-        with open(logs[1]) as f:
-            for i, line in enumerate(f):
-                if re.findall('Adapter sequence', line) and adapter_seq_2 is None:
-                    adapter_seq_2 = re.search('Adapter sequence:[^"]*',line).group().split(':')[1].strip()
-                    adapter_seq_2 = re.sub("'","",adapter_seq_2)
-                if re.findall('Sequence:[^"]*', line) and adapter_seq_2 is None:
-                    adapter_seq_2 = re.search('Sequence:[^"]*',line).group().split(';')[0].split(':')[1].strip()
-                if re.findall('Reads with adapters', line.strip()):
-                    trimmed_reads_2 = float(re.search('Reads with adapters:[^"]*',line).group().strip().split('(')[1].split(')')[0].split('%')[0])
-                if re.findall('Quality-trimmed:[^"]', line):
-                    qual_reads_2 = float(re.search('Quality-trimmed:[^"]*',line).group().strip().split('(')[1].split(')')[0].split('%')[0])
-                if re.findall('Number of sequence pairs removed', line.strip()):
-                    too_short = float(re.search('^Number of sequence pairs removed [\$|\W|\s|\S|\w]*',line).group().strip().split(':')[1].split('(')[1].split(')')[0].split('%')[0])
-
-            #trimmed_reads = "{:.2f}".format(float((trimmed_reads + trimmed_reads_2)/2))
-            #discarded_reads = discarded_reads + discarded_reads_2
+        fields_2 = parse_log(logs[1])
+        adapter_seq_2 = get_adapter(fields_2)
+        trimmed_reads_2 = get_percent(get_first(fields_2, 'Reads with adapters:'))
+        if trimmed_reads_2 is None:
+            trimmed_reads_2 = 'NA'
+        qual_reads_2 = get_percent(get_first(fields_2, 'Quality-trimmed:'), 0)
+        pairs_removed = get_percent(get_first(fields_2, 'Number of sequence pairs removed'))
+        if pairs_removed is not None:
+            too_short = pairs_removed
         stats_list=[qual_reads, qual_reads_2, trimmed_reads, trimmed_reads_2, too_short]
         out_list = dict(sample_name = sample_name, adapter = simplify(adapter_seq), adapter_2 = simplify(adapter_seq_2), stat = stats_list)
 
@@ -98,40 +176,27 @@ def get_cutadapt_summary(logs, sample_name):
     Extract statistics from cutadapt logs file
     For paired-end data, a single log file is parsed
     """
-    adapter_seq = trimmed_reads = None
-    adapter_seq_2 = trimmed_reads_2 = total_base = None
-    qual_reads = qual_reads_2  = too_short = 0
-    stats_list=()
- 
-    with open(logs[0]) as f:
-        for i, line in enumerate(f):
-            if re.findall('Sequence:[^"]*', line) and adapter_seq is None:
-                adapter_seq = re.search('Sequence:[^"]*',line).group().split(';')[0].split(':')[1].strip()
-            elif re.findall('Sequence:[^"]*', line) and adapter_seq is not None:
-                adapter_seq_2 = re.search('Sequence:[^"]*',line).group().split(';')[0].split(':')[1].strip()
-            if re.findall('Total basepairs processed:[^"]', line):
-                total_base=int(re.search('^Total basepairs processed:[^"]*',line).group().split(":")[1].strip().replace(" bp","").replace(",",""))
-            if re.findall('Quality-trimmed:[^"]', line):
-                qual_reads = float(re.search('Quality-trimmed:[^"]*',line).group().strip().split('(')[1].split(')')[0].split('%')[0])
-                qual_r1=re.search('Read 1:[^"]*',next(f))
-                if qual_r1 and total_base is not None:
-                    qual_r1=int(qual_r1.group().split(":")[1].strip().replace(" bp","").replace(",",""))
-                    qual_reads="{:.2f}".format(float((qual_r1 *100 / total_base)))
-                    qual_r2=re.search('Read 2:[^"]*',next(f))
-                    if qual_r2 and total_base is not None:
-                        qual_r2=int(qual_r2.group().split(":")[1].strip().replace(" bp","").replace(",",""))
-                        qual_reads_2="{:.2f}".format(float((qual_r1 *100 / total_base)))
-            if re.findall('Reads with adapters:', line.strip()):
-                trimmed_reads = float(re.search('Reads with adapters:[^"]*',line).group().strip().split('(')[1].split(')')[0].split('%')[0])
-            if re.findall('Read 1 with adapter:', line.strip()):
-                trimmed_reads = float(re.search('Read 1 with adapter:[^"]*',line).group().strip().split('(')[1].split(')')[0].split('%')[0])
-            if re.findall('Read 2 with adapter:', line.strip()):
-                trimmed_reads_2 = float(re.search('Read 2 with adapter:[^"]*',line).group().strip().split('(')[1].split(')')[0].split('%')[0])
-            if re.findall('Reads that were too short:', line.strip()):
-                too_short = float(re.search('^Reads that were too short: [^"]*',line).group().strip().split(':')[1].split('(')[1].split(')')[0].split('%')[0])
-            if re.findall('Pairs that were too short:', line.strip()):
-                too_short = float(re.search('^Pairs that were too short: [^"]*',line).group().strip().split(':')[1].split('(')[1].split(')')[0].split('%')[0])
- 
+    fields = parse_log(logs[0])
+    sequences = fields.get('Sequence:', [])
+    adapter_seq = sequences[0].split(';')[0].strip() if sequences else None
+    adapter_seq_2 = sequences[-1].split(';')[0].strip() if len(sequences) > 1 else None
+
+    total_base = get_int(get_first(fields, 'Total basepairs processed:'))
+    qual_reads = get_percent(get_first(fields, 'Quality-trimmed:'), 0)
+    qual_reads_2 = 0
+    qual_r1 = get_int(get_first(fields, 'Quality-trimmed:/Read 1:'))
+    if qual_r1 is not None and total_base:
+        qual_reads = "{:.2f}".format(float((qual_r1 * 100 / total_base)))
+        qual_r2 = get_int(get_first(fields, 'Quality-trimmed:/Read 2:'))
+        if qual_r2 is not None:
+            qual_reads_2 = "{:.2f}".format(float((qual_r2 * 100 / total_base)))
+
+    trimmed_reads = get_percent(get_first(fields, 'Reads with adapters:'))
+    if 'Read 1 with adapter:' in fields:
+        trimmed_reads = get_percent(get_first(fields, 'Read 1 with adapter:'))
+    trimmed_reads_2 = get_percent(get_first(fields, 'Read 2 with adapter:'))
+    too_short = get_percent(get_first(fields, 'Reads that were too short:') or get_first(fields, 'Pairs that were too short:'), 0)
+
     ## single-end
     if adapter_seq_2 is None and trimmed_reads_2 is None:
         stats_list=[qual_reads, trimmed_reads, too_short]
@@ -142,84 +207,195 @@ def get_cutadapt_summary(logs, sample_name):
 
     return(out_list)
 
+def load_fastp_sections(json_file):
+    """
+    Load the FASTP_SECTIONS of a fastp JSON report.
+    Raise a ValueError if the file is not a fastp JSON report (ie. its stderr log)
+    """
+    with open(json_file) as f:
+        try:
+            report = json.load(f)
+        except ValueError:
+            raise ValueError("{} is not a fastp JSON report".format(json_file))
+    if not isinstance(report, dict) or 'summary' not in report:
+        raise ValueError("{} is not a fastp JSON report (no 'summary' section)".format(json_file))
+    return dict((section, report[section]) for section in FASTP_SECTIONS if section in report)
+
+
+def percent(value, total):
+    """
+    Percentage formatted with 2 decimals, 'NA' if the total is null
+    """
+    if not total:
+        return 'NA'
+    return format(value / total * 100, '.2f')
+
+
 def get_fastp_summary(logs, sample_name):
     """
+    Extract statistics from fastp JSON report
     """
-    adapter_seq=adapter_seq_2=None
-    adapter_name=adapter_name_2='NA'
-    total_reads = trimmed_reads = qual_reads = polyA = too_short = 0
-    with open(logs[0]) as f:
-        for i, line in enumerate(f):
-            if re.findall('adapter sequence for read1', line):
-                adapter_name=next(f).strip()
-                adapter_seq=next(f).strip()
-            if re.findall('adapter sequence for read2', line):
-                adapter_name_2=next(f).strip()
-                adapter_seq_2=next(f).strip()
-            if re.findall('before filtering:', line):
-                total_reads += int(re.search('^total reads: [0-9]*',next(f)).group().strip().split(':')[1])
-            if re.findall('^reads with adapter trimmed:', line):
-                trimmed_reads = int(re.search('^reads with adapter trimmed: [0-9]*',line.strip()).group().split(':')[1])
-            if re.findall('^reads failed due to low quality:', line):
-                qual_reads = int(re.search('^reads failed due to low quality: [0-9]*',line.strip()).group().split(':')[1])
-            if re.findall('^reads with polyX:', line):
-                polyA = int(re.search('^reads with polyX: [0-9]*',line.strip()).group().split(':')[1])
-            if re.findall('^reads failed due to too short:', line):
-                too_short = int(re.search('^reads failed due to too short: [0-9]*',line.strip()).group().split(':')[1])
-
-    qual_reads=format(qual_reads/total_reads*100,('.2f'))
-    trimmed_reads=format(trimmed_reads/total_reads*100,('.2f'))
-    polyA=format(polyA/total_reads*100,('.2f'))
-    too_short=format(too_short/total_reads*100,('.2f'))
+    report = load_fastp_sections(logs[0])
+    summary = report.get('summary', {})
+    filtering = report.get('filtering_result', {})
+    adapters = report.get('adapter_cutting', {})
+
+    total_reads = summary.get('before_filtering', {}).get('total_reads', 0)
+    qual_reads = percent(filtering.get('low_quality_reads', 0), total_reads)
+    trimmed_reads = percent(adapters.get('adapter_trimmed_reads', 0), total_reads)
+    polyA = percent(report.get('polyx_trimming', {}).get('total_polyx_trimmed_reads', 0), total_reads)
+    too_short = percent(filtering.get('too_short_reads', 0), total_reads)
     stats_list=[qual_reads, trimmed_reads, polyA, too_short]
-    if adapter_seq_2 is not None:
+
+    adapter_seq = adapters.get('read1_adapter_sequence')
+    adapter_seq_2 = adapters.get('read2_adapter_sequence')
+    if adapter_seq_2 is not None or summary.get('sequencing', '').startswith('paired'):
         out_list = dict(sample_name = sample_name, adapter = simplify(adapter_seq), adapter_2 = simplify(adapter_seq_2), stat = stats_list)
     else:
         out_list = dict(sample_name = sample_name, adapter = simplify(adapter_seq), stat = stats_list)
     return out_list
 
- 
+
+SUMMARY_FUNCTIONS = {
+    'trimgalore': get_trimgalore_summary,
+    'cutadapt': get_cutadapt_summary,
+    'fastp': get_fastp_summary
+}
+
+## MultiQC table name and columns, for single-end and paired-end data
+SUMMARY_TABLES = {
+    'trimgalore': 'cutadapt',
+    'cutadapt': 'cutadapt',
+    'fastp': 'fastp'
+}
+SUMMARY_HEADERS = {
+    'cutadapt': (['Sample_id', 'Adapter', 'Qual_trimmed', 'Trimmed_reads', 'Too_short'],
+                 ['Sample_id', 'Adapter', 'Adapter_2', 'Qual_trimmed', 'Qual_trimmed_2', 'Trimmed_reads', 'Trimmed_reads_2', 'Too_short']),
+    'fastp': (['Sample_id', 'Adapter', 'Qual_trimmed', 'Trimmed_reads', 'PolyX', 'Too_short'],
+              ['Sample_id', 'Adapter', 'Adapter_2', 'Qual_trimmed', 'Trimmed_reads', 'PolyX', 'Too_short'])
+}
+
+
+def get_summary_row(stats_dict, atype, tool):
+    """
+    Return the columns and the values of the MultiQC table row of a trimming step
+    """
+    paired = "adapter_2" in stats_dict
+    header = SUMMARY_HEADERS[SUMMARY_TABLES[tool]][1 if paired else 0]
+    adapters = [stats_dict.get('adapter'), stats_dict.get('adapter_2')] if paired else [stats_dict.get('adapter')]
+    values = [stats_dict.get('sample_name') + " [" + atype + "]"] + adapters + list(map(str, stats_dict.get('stat')))
+    return header, values
+
+
 def write_summary(stats_dict, atype, oprefix, tool):
-    """ 
+    """
     Write tsv stats file.
     This file is read by MultiQC to summarize results of the trimming.
     """
-    my_formatted_list = stats_dict.get('stat')
-    for key, value in stats_dict.items():
-        if tool == "trimgalore" or tool == "cutadapt":
-            if len(stats_dict['stat']) == 3:
-                with open(oprefix + "_cutadapt_metrics.trim.tsv", 'w') as out:
-                    out.write('Sample_id'+'\t'+'Adapter'+'\t'+'Qual_trimmed'+'\t'+'Trimmed_reads'+'\t'+'Too_short'+'\n')
-                    out.write(stats_dict.get('sample_name') + " [" + atype + "]" + 
-                              '\t'+stats_dict.get('adapter')+'\t'+'\t'.join(map(str, my_formatted_list))+'\n')
-            elif len(stats_dict['stat']) == 5:
-                with open(oprefix + "_cutadapt_metrics.trim.tsv", 'w') as out:
-                    out.write('Sample_id'+'\t'+'Adapter'+'\t'+'Adapter_2'+'\t'+'Qual_trimmed'+'\t'+'Qual_trimmed_2'+'\t'+'Trimmed_reads'+'\t'+'Trimmed_reads_2'+'\t'+'Too_short'+'\n')
-                    out.write(stats_dict.get('sample_name')+ " [" + atype +"]" +
-                              '\t'+stats_dict.get('adapter')+'\t'+stats_dict.get('adapter_2')+'\t'+'\t'.join(map(str, my_formatted_list))+'\n')
-
-        if tool=="fastp":
-            if "adapter_2" in stats_dict.keys():
-                with open(oprefix + "_fastp_metrics.trim.tsv", 'w') as out:
-                    out.write('Sample_id'+'\t'+'Adapter'+'\t'+'Adapter_2'+'\t'+'Qual_trimmed'+'\t'+'Trimmed_reads'+'\t'+'PolyX'+'\t'+'Too_short'+'\n')
-                    out.write(stats_dict.get('sample_name')+ " [" + atype +"]" +
-                              '\t'+stats_dict.get('adapter')+'\t'+stats_dict.get('adapter_2')+'\t'+'\t'.join(map(str, my_formatted_list))+'\n')
+    if tool not in SUMMARY_TABLES:
+        return
+    header, values = get_summary_row(stats_dict, atype, tool)
+    with open(oprefix + "_" + SUMMARY_TABLES[tool] + "_metrics.trim.tsv", 'w') as out:
+        out.write('\t'.join(header) + '\n')
+        out.write('\t'.join(values) + '\n')
+
+
+def write_combined_summary(rows, oprefix, table):
+    """
+    Write all trimming steps of a given table in a single tsv stats file.
+    Single-end rows get 'NA' in the paired-end columns.
+    """
+    single_header, paired_header = SUMMARY_HEADERS[table]
+    header = paired_header if any(len(h) == len(paired_header) for h, v in rows) else single_header
+    with open(oprefix + "_" + table + "_metrics.trim.tsv", 'w') as out:
+        out.write('\t'.join(header) + '\n')
+        for row_header, values in rows:
+            row = dict(zip(row_header, values))
+            out.write('\t'.join(row.get(col, 'NA') for col in header) + '\n')
+
+
+def write_fragment(sample_name, tables):
+    """
+    Write the trimming rows of a sample, per MultiQC table, as a JSON fragment merged by stats2multiqc.py
+    """
+    fragment = OrderedDict([("type", "trimming"), ("sample", sample_name), ("tables", tables)])
+    with open(sample_name + ".trimming.fragment.json", 'w') as out:
+        json.dump(fragment, out)
+
+
+def fastp_sample_name(json_file):
+    return os.path.basename(json_file).replace('.fastp.json', '').replace('.json', '')
+
+
+def read_manifest(manifest):
+    """
+    Read the batch manifest file.
+    Each line describes one trimming step: sample name, trimming tool, adapter type, output prefix, comma-separated logs
+    """
+    with open(manifest) as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            sample_name, tool, atype, oprefix, logs = line.rstrip('\n').split('\t')
+            yield sample_name, tool, atype, oprefix, logs.split(',')
+
+
+def main(argv=None):
+    args = get_options(argv)
+
+    if args.manifest is not None:
+        steps = list(read_manifest(args.manifest))
+    elif args.trim_tool == "fastp" and len(args.logs) > 1:
+        ## several fastp reports, one per sample
+        steps = [(fastp_sample_name(log), "fastp", args.atype, args.oprefix, [log]) for log in args.logs]
+        args.combined = True
+    else:
+        steps = [(args.name, args.trim_tool, args.atype, args.oprefix, args.logs)]
+
+    cache = None
+    if args.cache and not args.no_cache:
+        from qc_cache import ResultCache, source_version
+        cache = ResultCache(args.cache, version=source_version([__file__]), max_size=args.cache_size * 1024 * 1024)
+
+    perf = PerfRecorder("trimming_report")
+    combined_rows = {}
+    fragments = OrderedDict()
+    for sample_name, tool, atype, oprefix, logs in steps:
+        if tool not in SUMMARY_FUNCTIONS:
+            sys.stderr.write("Unknown trimming tool '{}' for sample {}\n".format(tool, sample_name))
+            sys.exit(1)
+        with perf.stage(atype, sample=sample_name) as st:
+            summary_dict = None
+            if cache is not None:
+                key = cache.key("trimming_report", logs, {"tool": tool, "sample_name": sample_name})
+                summary_dict = cache.get(key)
+            if summary_dict is None:
+                try:
+                    summary_dict = SUMMARY_FUNCTIONS[tool](logs, sample_name=sample_name)
+                except ValueError as e:
+                    sys.stderr.write("Error for sample {}: {}\n".format(sample_name, e))
+                    sys.exit(1)
+                st.add(bytes_read=file_size(logs), records=len(logs))
+                if cache is not None:
+                    cache.put(key, summary_dict)
+            if args.fragments and tool in SUMMARY_TABLES:
+                tables = fragments.setdefault(sample_name, OrderedDict())
+                tables.setdefault(SUMMARY_TABLES[tool], []).append(get_summary_row(summary_dict, atype, tool))
+            if args.combined:
+                combined_rows.setdefault(SUMMARY_TABLES[tool], []).append(get_summary_row(summary_dict, atype, tool))
             else:
-                with open(oprefix + "_fastp_metrics.trim.tsv", 'w') as out:
-                    out.write('Sample_id'+'\t'+'Adapter'+'\t'+'Qual_trimmed'+'\t'+'Trimmed_reads'+'\t'+'PolyX'+'\t'+'Too_short'+'\n')
-                    out.write(stats_dict.get('sample_name')+ " [" + atype +"]" +
-                              '\t'+stats_dict.get('adapter')+'\t'+'\t'.join(map(str, my_formatted_list))+'\n')
+                if args.manifest is None:
+                    print(summary_dict)
+                write_summary(summary_dict, atype=atype, oprefix=oprefix, tool=tool)
+
+    with perf.stage("write"):
+        for table, rows in combined_rows.items():
+            write_combined_summary(rows, oprefix=args.oprefix or "all", table=table)
+        for sample_name, tables in fragments.items():
+            write_fragment(sample_name, tables)
+
+    perf.write(args.oprefix or args.name or "all")
 
 
 if __name__ == '__main__':
-    args = get_options()
-    
-    if args.trim_tool == "trimgalore":
-        summary_dict = get_trimgalore_summary(args.logs, sample_name=args.name)
-    elif args.trim_tool == "cutadapt":
-        summary_dict = get_cutadapt_summary(args.logs, sample_name=args.name)
-    elif args.trim_tool == "fastp":
-        summary_dict = get_fastp_summary(args.logs, sample_name=args.name)
-
-    print(summary_dict)
-    write_summary(summary_dict, atype=args.atype, oprefix=args.oprefix, tool=args.trim_tool)
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+
+#############################################################################################
+# Copyright Institut Curie 2022                                                             #
+#                                                                                           #
+# This software is a computer program whose purpose                                         #
+# is to analyze high-throughput sequencing data.                                            #
+# You can use, modify and/ or redistribute the software under                               #
+# the terms of license (see the LICENSE file for more details).                             #
+# The software is distributed in the hope that it will be useful,                           #
+# but "AS IS" WITHOUT ANY WARRANTY OF ANY KIND.                                             #
+# Users are therefore encouraged to test the software's suitabilityas regards               #
+# their requirements in conditions enabling the security of their systems and/or data.      #
+# The fact that you are presently reading this means that                                   #
+# you have had knowledge of the license and that you accept its terms.                      #
+#############################################################################################
+
+"""
+Run a xengsort classification with its per-class fastq outputs replaced by named pipes.
+Each class is compressed while xengsort writes it (pigz, igzip, or zlib in a thread
+if none of them is available), and its reads are counted on the fly.
+The compressed files are named as the renamed xengsort outputs ('<prefix>-<class>.fastq.gz',
+or '<prefix>-<class>_R1.fastq.gz' and '_R2.fastq.gz' for paired-end data).
+The number of reads (pairs) per class is written in a '<sample>_xengsort.json' summary,
+merged in the MultiQC general metrics table by stats2multiqc.py.
+The standard output of xengsort is not modified.
+
+Example:
+  xengsort_stream.py --prefix S1 --pe -t 4 -- \\
+    xengsort classify -T 4 --index idx.h5 --fastq R1.fq.gz --pairs R2.fq.gz --prefix S1 > S1_xengsort.log
+"""
+
+import os
+import sys
+import json
+import zlib
+import shutil
+import argparse
+import threading
+import subprocess
+from collections import OrderedDict
+
+BLOCK_SIZE = 1024 * 1024
+CLASSES = ["host", "graft", "ambiguous", "both", "neither"]
+SUMMARY_SUFFIX = "_xengsort.json"
+
+## Compressors, by order of preference, with their multi-threading option
+COMPRESSORS = [("pigz", ["-c", "-p"]), ("igzip", ["-c", "-T"])]
+
+
+def get_options():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="xengsort classify command line (after '--')")
+    parser.add_argument("--prefix", required=True, help="Output prefix given to xengsort")
+    parser.add_argument("-s", "--sample", default=None, help="Sample id of the summary (default: prefix)")
+    parser.add_argument("--pe", action="store_true", help="Paired-end data")
+    parser.add_argument("-t", "--threads", type=int, default=2, help="Number of threads of each compressor")
+    parser.add_argument("-l", "--level", type=int, default=6, help="Compression level")
+    parser.add_argument("--no_compressor", action="store_true", help="Always compress with zlib")
+    args = parser.parse_args()
+    if args.command and args.command[0] == '--':
+        args.command = args.command[1:]
+    if not args.command:
+        parser.error("the xengsort command is missing")
+    return(args)
+
+
+def get_compressor(threads, level=6, allowed=True):
+    """
+    Command line of the first multi-threaded compressor found in the PATH, if any
+    """
+    if not allowed:
+        return None
+    for tool, opts in COMPRESSORS:
+        path = shutil.which(tool)
+        if path:
+            ## igzip only has levels 0 to 3
+            lvl = min(level, 3) if tool == "igzip" else level
+            return [path, "-{}".format(lvl)] + opts + [str(max(threads, 1))]
+    return None
+
+
+def get_streams(prefix, pe):
+    """
+    Named pipes written by xengsort and their compressed outputs, as a list of
+    (class, mate, pipe, output)
+    """
+    streams = []
+    for cls in CLASSES:
+        if pe:
+            for mate in (1, 2):
+                streams.append((cls, mate, "{}-{}.{}.fq".format(prefix, cls, mate),
+                                "{}-{}_R{}.fastq.gz".format(prefix, cls, mate)))
+        else:
+            streams.append((cls, 1, "{}-{}.fq".format(prefix, cls), "{}-{}.fastq.gz".format(prefix, cls)))
+    return streams
+
+
+class ZlibWriter(object):
+    """
+    Gzip writer, used when no compressor is available. zlib releases the GIL,
+    so that the classes are still compressed in parallel.
+    """
+
+    def __init__(self, out, level=6):
+        self.out = out
+        self.comp = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def write(self, block):
+        self.out.write(self.comp.compress(block))
+
+    def close(self):
+        self.out.write(self.comp.flush())
+        self.out.close()
+
+
+class Stream(threading.Thread):
+    """
+    Read a named pipe, count its lines and compress it. Opening the pipe blocks
+    until xengsort opens it too.
+    """
+
+    def __init__(self, cls, mate, pipe, output, compressor=None, level=6):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.cls = cls
+        self.mate = mate
+        self.pipe = pipe
+        self.output = output
+        self.compressor = compressor
+        self.level = level
+        self.opened = threading.Event()
+        self.unused = False
+        self.lines = 0
+        self.error = None
+
+    def run(self):
+        try:
+            with open(self.pipe, 'rb', buffering=0) as f:
+                self.opened.set()
+                self.copy(f)
+        except Exception as e:
+            self.error = e
+
+    def copy(self, f):
+        out = open(self.output, 'wb')
+        proc = None
+        if self.compressor is not None:
+            proc = subprocess.Popen(self.compressor, stdin=subprocess.PIPE, stdout=out)
+            out.close()
+            writer = proc.stdin
+        else:
+            writer = ZlibWriter(out, level=self.level)
+        last = b'\n'
+        try:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                self.lines += block.count(b'\n')
+                last = block[-1:]
+                writer.write(block)
+        finally:
+            writer.close()
+            if proc is not None and proc.wait() != 0:
+                raise IOError("{} failed on {}".format(os.path.basename(self.compressor[0]), self.pipe))
+        ## last record without a final newline
+        if last != b'\n':
+            self.lines += 1
+
+    def release(self):
+        """
+        Unblock the thread if xengsort never opened the pipe (ie. classes not written)
+        """
+        if self.opened.is_set():
+            return
+        self.unused = True
+        try:
+            os.close(os.open(self.pipe, os.O_WRONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+
+    @property
+    def reads(self):
+        return self.lines // 4
+
+
+def run_classification(command, streams):
+    """
+    Run xengsort while the streams read its outputs. Return its exit status.
+    """
+    for st in streams:
+        if os.path.exists(st.pipe):
+            os.remove(st.pipe)
+        os.mkfifo(st.pipe)
+    for st in streams:
+        st.start()
+    try:
+        ## keep the inherited file descriptors, ie. '<(...)' inputs of xengsort
+        status = subprocess.call(command, close_fds=False)
+    finally:
+        for st in streams:
+            st.release()
+        for st in streams:
+            st.join()
+            os.remove(st.pipe)
+            ## only keep the outputs of the classes written by xengsort
+            if st.unused and st.lines == 0 and os.path.exists(st.output):
+                os.remove(st.output)
+    return status
+
+
+def get_counts(streams, pe):
+    """
+    Number of reads (pairs) per class. Mates of a class must have the same number of reads.
+    """
+    counts = OrderedDict((cls, 0) for cls in CLASSES)
+    for st in streams:
+        if st.mate == 1:
+            counts[st.cls] = st.reads
+    if pe:
+        for st in streams:
+            if st.mate == 2 and st.reads != counts[st.cls]:
+                raise ValueError("Different number of reads for R1 ({}) and R2 ({}) of class '{}'".format(counts[st.cls], st.reads, st.cls))
+    return counts
+
+
+def write_summary(sample, counts, pe, output_dir="."):
+    """
+    Write the '<sample>_xengsort.json' summary
+    """
+    summary = OrderedDict([("type", "xengsort"), ("sample", sample), ("paired", pe),
+                           ("total", sum(counts.values())), ("counts", counts)])
+    output = os.path.join(output_dir, "{}{}".format(sample, SUMMARY_SUFFIX))
+    with open(output, 'w') as f:
+        json.dump(summary, f, indent=2)
+    return output
+
+
+if __name__ == '__main__':
+    args = get_options()
+
+    compressor = get_compressor(args.threads, level=args.level, allowed=not args.no_compressor)
+    streams = [Stream(cls, mate, pipe, output, compressor=compressor, level=args.level)
+               for cls, mate, pipe, output in get_streams(args.prefix, args.pe)]
+
+    status = run_classification(args.command, streams)
+    if status != 0:
+        sys.stderr.write("{} failed with status {}\n".format(os.path.basename(args.command[0]), status))
+        sys.exit(status)
+    for st in streams:
+        if st.error is not None:
+            sys.stderr.write("Error while compressing {}: {}\n".format(st.pipe, st.error))
+            sys.exit(1)
+
+    try:
+        counts = get_counts(streams, args.pe)
+    except ValueError as e:
+        sys.stderr.write("{}\n".format(e))
+        sys.exit(1)
+    write_summary(args.sample or args.prefix, counts, args.pe)
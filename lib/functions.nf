@@ -20,3 +20,17 @@ def checkAlignmentPercent(prefix, logs) {
       return true
   }
 }
+
+// Adapters detected by detect_adapters.py, as meta attributes (adapterR1, adapterR2)
+def getDetectedAdapters(sampleId, tsv) {
+  def adapters = [:]
+  tsv.splitCsv(sep: '\t', header: true).each { row ->
+    if (row.Trim_sequence && row.Trim_sequence != 'NA') {
+      adapters["adapter${row.Read}"] = row.Trim_sequence
+    }
+  }
+  if (!adapters) {
+    log.warn "No 3' adapter detected for ${sampleId}, using the trimming tool auto-detection"
+  }
+  return adapters
+}
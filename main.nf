@@ -33,6 +33,7 @@ customRunName = NFTools.checkRunName(workflow.runName, params.name)
 // Custom functions/variables
 mqcReport = []
 include {checkAlignmentPercent} from './lib/functions'
+include {getDetectedAdapters} from './lib/functions'
 
 /*
 ===================================
@@ -47,6 +48,7 @@ params.xengsortIndex = NFTools.getGenomeAttribute(params, 'xengsort', genome='pd
 
 // Stage config files
 multiqcConfigCh = Channel.fromPath(params.multiqcConfig)
+adaptersFastaCh = Channel.fromPath(params.adaptersFasta)
 outputDocsCh = Channel.fromPath("$projectDir/docs/output.md")
 outputDocsImagesCh = file("$projectDir/docs/images/", checkIfExists: true)
 
@@ -140,6 +142,7 @@ include { fastpFlow } from './nf-modules/local/subworkflow/fastp'
 include { getSoftwareVersions } from './nf-modules/common/process/utils/getSoftwareVersions'
 include { outputDocumentation } from './nf-modules/common/process/utils/outputDocumentation'
 include { generalMetrics } from './nf-modules/local/process/generalMetrics'
+include { detectAdapters } from './nf-modules/local/process/detectAdapters'
 include { fastqc as fastqcRaw } from './nf-modules/common/process/fastqc/fastqc'
 include { fastqc as fastqcTrim } from './nf-modules/common/process/fastqc/fastqc'
 include { xengsort } from './nf-modules/common/process/xengsort/xengsort'
@@ -174,24 +177,38 @@ workflow {
     ======================================
     */
 
+    // PROCESS: 3' adapter detection on the first reads
+    trimInputCh = rawReadsCh
+    if (params.adapter == 'detect' && !params.skipTrimming){
+      detectAdapters(
+        rawReadsCh,
+        adaptersFastaCh.collect()
+      )
+      trimInputCh = rawReadsCh.join(detectAdapters.out.tsv)
+        .map{ meta, reads, tsv -> [meta + getDetectedAdapters(meta.id, tsv), reads] }
+    }
+
     // SUBWORKFLOW: Trimming
 
     trimReadsCh = rawReadsCh
     trimMqcCh = Channel.empty()
+    perfCh = Channel.empty()
     if ( params.trimTool == 'trimgalore' && !params.skipTrimming){
       trimgaloreFlow(
-        rawReadsCh
+        trimInputCh
       )
       versionsCh = versionsCh.mix(trimgaloreFlow.out.versions)
       trimReadsCh = trimgaloreFlow.out.fastq
-      trimMqcCh = trimgaloreFlow.out.mqc
+      trimMqcCh = trimgaloreFlow.out.fragments
+      perfCh = perfCh.mix(trimgaloreFlow.out.perf)
     }else if ( params.trimTool == "fastp" && !params.skipTrimming){
       fastpFlow(
-        rawReadsCh
+        trimInputCh
       )
       versionsCh = versionsCh.mix(fastpFlow.out.versions)
       trimReadsCh = fastpFlow.out.fastq
-      trimMqcCh = fastpFlow.out.mqc
+      trimMqcCh = fastpFlow.out.fragments
+      perfCh = perfCh.mix(fastpFlow.out.perf)
     }
     
     /*
@@ -230,12 +247,16 @@ workflow {
     if (params.skipTrimming){
       inputMetricsCh = rawReadsCh.map{[it[0], it[1], []]}
     }else{
-      inputMetricsCh = rawReadsCh.join(trimReadsCh)
+      // trimmed reads can have the detected adapters in their meta
+      inputMetricsCh = rawReadsCh.map{ [it[0].id, it[0], it[1]] }
+        .join(trimReadsCh.map{ [it[0].id, it[1]] })
+        .map{ id, meta, raw, trim -> [meta, raw, trim] }
     }
 
     generalMetrics(
       inputMetricsCh
     )
+    perfCh = perfCh.mix(generalMetrics.out.perf)
 
     if (!params.skipMultiqc){
 
@@ -250,12 +271,13 @@ workflow {
         multiqcConfigCh.ifEmpty([]),
         fastqcRaw.out.results.collect().ifEmpty([]),
 	trimMqcCh.collect().ifEmpty([]),
-	generalMetrics.out.csv.collect().ifEmpty([]),
+	generalMetrics.out.fragment.mix(generalMetrics.out.seqqual, generalMetrics.out.saturation, generalMetrics.out.qc).collect().ifEmpty([]),
 	fastqcTrim.out.results.collect().ifEmpty([]),
-        xengsort.out.logs.collect().ifEmpty([]),
+        xengsort.out.logs.mix(xengsort.out.summary).collect().ifEmpty([]),
         fastqScreenFlow.out.mqc.collect().ifEmpty([]),
 	getSoftwareVersions.out.versionsYaml.collect().ifEmpty([]),
 	workflowSummaryCh.collectFile(name: "workflow_summary_mqc.yaml"),
+        perfCh.collect().ifEmpty([]),
         warnCh.collect().ifEmpty([])
       )
       mqcReport = multiqc.out.report.toList()
@@ -14,6 +14,7 @@ process fastp {
   output:
   tuple val(meta), path("*trimmed*fastq.gz"), emit: fastq
   tuple val(meta), path("*.log"), emit: logs
+  tuple val(meta), path("*.fastp.json"), emit: json
   path ("versions.txt"), emit: versions
 
   when:
@@ -22,7 +23,8 @@ process fastp {
   script:
   def prefix = task.ext.prefix ?: "${meta.id}"
   def args = task.ext.args ?: ''
-  def inputs = meta.singleEnd ? "-i ${reads} -o ${prefix}_trimmed.fastq.gz" : "--detect_adapter_for_pe -i ${reads[0]} -I ${reads[1]} -o ${prefix}_trimmed_R1.fastq.gz -O ${prefix}_trimmed_R2.fastq.gz"
+  def detect = meta.adapterR1 ? "" : "--detect_adapter_for_pe"
+  def inputs = meta.singleEnd ? "-i ${reads} -o ${prefix}_trimmed.fastq.gz" : "${detect} -i ${reads[0]} -I ${reads[1]} -o ${prefix}_trimmed_R1.fastq.gz -O ${prefix}_trimmed_R2.fastq.gz"
 
   """
   fastp \
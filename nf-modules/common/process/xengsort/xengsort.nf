@@ -16,6 +16,7 @@ process xengsort {
   tuple val(meta),path("*graft*.fastq.gz"), emit: fastqHuman
   tuple val(meta),path("*host*.fastq.gz"), emit: fastqMouse
   path("*.log"), emit: logs
+  path("*_xengsort.json"), emit: summary
   path("versions.txt") , emit: versions
 
   when:
@@ -24,11 +25,14 @@ process xengsort {
   script:
   def args = task.ext.args ?: ''
   def prefix = task.ext.prefix ?: "${meta.id}"
-  def inputs = meta.singleEnd ? "--fastq <(zcat ${reads})" : "--fastq <(zcat ${reads[0]})  --pairs <(zcat ${reads[1]})"
+  def pe = meta.singleEnd ? '' : '--pe'
+  def inputs = meta.singleEnd ? "--fastq <(\${unzip} ${reads})" : "--fastq <(\${unzip} ${reads[0]})  --pairs <(\${unzip} ${reads[1]})"
   """
   echo "xengsort "\$(xengsort --version) > versions.txt
-  xengsort classify -T ${task.cpus} --index ${index} ${inputs} --prefix ${prefix} ${args} > ${prefix}_xengsort.log
-  for f in *.fq; do out=\$(echo "\$f" | sed -e 's/.1.fq/_R1.fastq/g' -e 's/.2.fq/_R2.fastq/' -e 's/.fq/.fastq/'); mv -- "\$f" "\$out"; done
-  gzip *.fastq
+  ## faster inflaters than zcat, if available
+  unzip="zcat"
+  if command -v igzip > /dev/null; then unzip="igzip -dc"; elif command -v pigz > /dev/null; then unzip="pigz -dc -p 2"; fi
+  xengsort_stream.py --prefix ${prefix} -s ${meta.id} ${pe} -t ${task.cpus} -- \\
+    xengsort classify -T ${task.cpus} --index ${index} ${inputs} --prefix ${prefix} ${args} > ${prefix}_xengsort.log
   """
 }
@@ -0,0 +1,33 @@
+/*
+ * Detect the 3' adapter from the first reads, before trimming
+ */
+
+process detectAdapters {
+  tag "${meta.id}"
+  label 'python'
+  label 'minCpu'
+  label 'minMem'
+
+  input:
+  tuple val(meta), path(reads)
+  path adapters
+
+  output:
+  tuple val(meta), path('*_adapters.tsv'), emit: tsv
+
+  when:
+  task.ext.when == null || task.ext.when
+
+  script:
+  def prefix = task.ext.prefix ?: "${meta.id}"
+  def args = task.ext.args ?: ''
+  def inputs = meta.singleEnd ? "-i $reads" : "-i ${reads[0]} -I ${reads[1]}"
+  """
+  detect_adapters.py \
+    ${args} \
+    $inputs \
+    -a ${adapters} \
+    -s ${meta.id} \
+    -o ${prefix}_adapters.tsv
+  """
+}
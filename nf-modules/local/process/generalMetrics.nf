@@ -4,8 +4,8 @@
 
 process generalMetrics {
   tag "${meta.id}"
-  label 'onlylinux'
-  label 'minCpu'
+  label 'python'
+  label 'medCpu'
   label 'minMem'
 
   input:
@@ -13,6 +13,11 @@ process generalMetrics {
 
   output:
   path '*stats.trim.csv', emit: csv
+  path '*.general.fragment.json', emit: fragment
+  path '*_seqqual.tsv', optional: true, emit: seqqual
+  path '*_saturation.tsv', optional: true, emit: saturation
+  path '*_{basequal,basequal_quantiles,basecontent,ncontent,gccontent}.tsv', optional: true, emit: qc
+  path '*.perf.json', optional: true, emit: perf
 
   when:
   task.ext.when == null || task.ext.when
@@ -23,9 +28,14 @@ process generalMetrics {
   def inputs = meta.singleEnd ? "-i $reads" : "-i ${reads[0]} -I ${reads[1]}"
   def trims = trims ? meta.singleEnd ? "-t $trims" : "-t ${trims[0]} -T ${trims[1]}" : ""
   """
-  general_metrics.sh \
+  fastq_metrics.py \
+    ${args} \
     $inputs \
     $trims \
+    -p ${task.cpus} \
+    --seqqual \
+    --complexity \
+    --fragment \
     -s ${meta.id} > ${prefix}_stats.trim.csv
   """
 }
\ No newline at end of file
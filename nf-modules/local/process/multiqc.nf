@@ -20,12 +20,14 @@ process multiqc {
   path ('fastq_screen/*')
   path ('software_versions/*')
   path ('workflow_summary/*')
+  path ('perf/*')
   path warnings
 
   output:
   path splan
   path "*_report.html", emit: report
   path "*_data"
+  path "historical_*.tsv", optional: true
   path("versions.txt"), emit: versions
 
   script:
@@ -34,11 +36,19 @@ process multiqc {
   isPE = params.singleEnd ? 0 : 1
   metadataOpts = params.metadata ? "--metadata ${metadata}" : ""
   splanOpts = params.samplePlan ? "--splan ${params.samplePlan}" : ""
+  cacheOpts = params.cacheDir ? "--cache ${params.cacheDir}" : ""
+  runId = custom_runName ?: workflow.sessionId
+  qcStoreImport = params.qcStore ? "qc_store.py --db ${params.qcStore} import -r ${runId} -s mq.stats -t *_metrics.trim.tsv --hist trimming/*_seqqual.tsv trimming/*_saturation.tsv -v ${workflow.manifest.version} ${metadataOpts}" : ""
+  qcStoreOutliers = params.qcStore ? "qc_store.py --db ${params.qcStore} outliers -r ${runId} --mqc historical_qc.tsv > historical_outliers.tsv" : ""
 
   """
   multiqc --version &> versions.txt 2>&1
-  mqc_header.py --name "Raw-QC" --version ${workflow.manifest.version} ${metadataOpts} ${splanOpts} > multiqc-config-header.yaml
-  stats2multiqc.sh ${splan} ${isPE}
+  rawqc-tools batch <<EOF
+  header --name "Raw-QC" --version ${workflow.manifest.version} ${metadataOpts} ${splanOpts} > multiqc-config-header.yaml
+  stats ${splan} ${isPE} --threads ${task.cpus} --fragments trimming ${cacheOpts} --perf_dir perf
+  EOF
+  ${qcStoreImport}
+  ${qcStoreOutliers}
   multiqc . -f $rtitle $rfilename -c $multiqcConfig -c multiqc-config-header.yaml -m custom_content -m cutadapt -m fastqc -m fastp -m fastq_screen
   """
 }
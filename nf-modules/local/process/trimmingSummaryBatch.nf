@@ -0,0 +1,30 @@
+/*
+ * Build trimming reports for MultiQC, for all samples and trimming steps at once
+ */
+
+process trimmingSummaryBatch {
+  label 'python'
+  label 'minCpu'
+  label 'minMem'
+
+  input:
+  path manifest
+  path logs
+
+  output:
+  path '*metrics.trim.tsv', emit: mqc
+  path '*.trimming.fragment.json', optional: true, emit: fragments
+  path '*.perf.json', optional: true, emit: perf
+
+  when:
+  task.ext.when == null || task.ext.when
+
+  script:
+  def args = task.ext.args ?: ''
+  """
+  rawqc-tools trimming \
+    ${args} \
+    --manifest ${manifest} \
+    --fragments
+  """
+}
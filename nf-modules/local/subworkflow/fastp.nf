@@ -4,7 +4,7 @@
 
 
 include { fastp } from '../../common/process/fastp/fastp'
-include { trimmingSummary as trimmingSummaryFastp } from '../../local/process/trimmingSummary'
+include { trimmingSummaryBatch } from '../../local/process/trimmingSummaryBatch'
 
 workflow fastpFlow {
 
@@ -29,14 +29,19 @@ workflow fastpFlow {
   chVersions = chVersions.mix(fastp.out.versions)
   chTrimReads = fastp.out.fastq
 
-  trimmingSummaryFastp(
-    fastp.out.logs
+  chSummary = fastp.out.json.map{ meta, json -> [meta.id, 'fastp', '3-prime adapters', "${meta.id}_adapter", json] }
+  trimmingSummaryBatch(
+    chSummary.map{ id, tool, atype, prefix, logs -> [id, tool, atype, prefix, [logs].flatten().collect{ it.name }.join(',')].join('\t') }
+      .collectFile(name: 'trimmingManifest.tsv', newLine: true),
+    chSummary.map{ it[4] }.flatten().collect()
   )
 
   emit:
   fastq = chTrimReads
   logs = fastp.out.logs
-  mqc = trimmingSummary.out.mqc
+  mqc = trimmingSummaryBatch.out.mqc
+  fragments = trimmingSummaryBatch.out.fragments
+  perf = trimmingSummaryBatch.out.perf
   versions = chVersions
 }
 
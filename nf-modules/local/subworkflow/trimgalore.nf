@@ -5,9 +5,7 @@
 include { trimGalore } from '../../common/process/trimGalore/trimGalore' 
 include { cutadapt as trimAdapter5p } from '../../common/process/cutadapt/cutadapt'
 include { cutadapt as trimPolyA } from '../../common/process/cutadapt/cutadapt'
-include { trimmingSummary as trimmingSummary3p } from '../../local/process/trimmingSummary'
-include { trimmingSummary as trimmingSummary5p } from '../../local/process/trimmingSummary'
-include { trimmingSummary as trimmingSummaryPolyA } from '../../local/process/trimmingSummary'
+include { trimmingSummaryBatch } from '../../local/process/trimmingSummaryBatch'
 //include { trimmingStats } from '../../local/process/trimmingStats'
 
 workflow trimgaloreFlow {
@@ -20,6 +18,7 @@ workflow trimgaloreFlow {
   chTrimReads = Channel.empty()
   chTrimMqc = Channel.empty()
   chTrimLogs = Channel.empty()
+  chSummary = Channel.empty()
 
   /*
    =======================================================
@@ -33,10 +32,7 @@ workflow trimgaloreFlow {
   chVersions = chVersions.mix(trimGalore.out.versions)
   chTrimReads = trimGalore.out.fastq
 
-  trimmingSummary3p(
-    trimGalore.out.logs
-  )
-  chTrimMqc = chTrimMqc.mix(trimmingSummary3p.out.mqc)
+  chSummary = chSummary.mix(trimGalore.out.logs.map{ meta, logs -> [meta.id, params.trimTool, '3-prime adapter', "${meta.id}_adapter3p", logs] })
   chTrimLogs = chTrimLogs.mix(chTrimLogs)   
 
   /*
@@ -52,10 +48,7 @@ workflow trimgaloreFlow {
     chVersions = chVersions.mix(trimAdapter5p.out.versions)
     chTrimReads = trimAdapter5p.out.fastq
 
-    trimmingSummary5p(
-      trimAdapter5p.out.logs
-    )
-    chTrimMqc = chTrimMqc.mix(trimmingSummary5p.out.mqc)
+    chSummary = chSummary.mix(trimAdapter5p.out.logs.map{ meta, logs -> [meta.id, 'cutadapt', '5-prime adapter', "${meta.id}_adapter5p", logs] })
     chTrimLogs = chTrimLogs.mix(trimAdapter5p.out.logs)
   }
 
@@ -72,17 +65,29 @@ workflow trimgaloreFlow {
     chVersions = chVersions.mix(trimPolyA.out.versions)
     chTrimReads = trimPolyA.out.fastq
     
-    trimmingSummaryPolyA(
-      trimPolyA.out.logs
-    )
-    chTrimMqc = chTrimMqc.mix(trimmingSummaryPolyA.out.mqc)
+    chSummary = chSummary.mix(trimPolyA.out.logs.map{ meta, logs -> [meta.id, 'cutadapt', '3-prime polyA', "${meta.id}_polyA", logs] })
     chTrimLogs = chTrimLogs.mix(trimPolyA.out.logs)
   }
 
+  /*
+   ==========================================
+    Trimming reports of all samples and steps
+   ==========================================
+  */
+
+  trimmingSummaryBatch(
+    chSummary.map{ id, tool, atype, prefix, logs -> [id, tool, atype, prefix, [logs].flatten().collect{ it.name }.join(',')].join('\t') }
+      .collectFile(name: 'trimmingManifest.tsv', newLine: true),
+    chSummary.map{ it[4] }.flatten().collect()
+  )
+  chTrimMqc = chTrimMqc.mix(trimmingSummaryBatch.out.mqc)
+
   emit:
   fastq = chTrimReads
   logs = chTrimLogs
   mqc = chTrimMqc
+  fragments = trimmingSummaryBatch.out.fragments
+  perf = trimmingSummaryBatch.out.perf
   versions = chVersions
 }
 
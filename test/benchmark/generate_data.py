@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+
+
+#############################################################################################
+# Copyright Institut Curie 2022                                                             #
+#                                                                                           #
+# This software is a computer program whose purpose                                         #
+# is to analyze high-throughput sequencing data.                                            #
+# You can use, modify and/ or redistribute the software under                               #
+# the terms of license (see the LICENSE file for more details).                             #
+# The software is distributed in the hope that it will be useful,                           #
+# but "AS IS" WITHOUT ANY WARRANTY OF ANY KIND.                                             #
+# Users are therefore encouraged to test the software's suitabilityas regards               #
+# their requirements in conditions enabling the security of their systems and/or data.      #
+# The fact that you are presently reading this means that                                   #
+# you have had knowledge of the license and that you accept its terms.                      #
+#############################################################################################
+
+"""
+Generate a synthetic raw-qc dataset for benchmarking:
+- raw and trimmed fastq files (with adapter read-through) for the first samples
+- trimgalore, cutadapt and fastp logs, xengsort logs, general metrics and
+  per sequence quality files for all samples
+- FastQC zip files of the trimmed reads for every other sample, so that both
+  sources of the Q20 counts of stats2multiqc.py are used
+- the sample plan and the trimming manifest used by trimming_report.py
+Layout of the output directory:
+  samplePlan.csv, trimmingManifest.tsv, fastq/, logs/, stats/, xengsort/, fastqc/
+"""
+
+import os
+import gzip
+import json
+import zipfile
+import argparse
+
+import numpy as np
+
+ADAPTER_R1 = "AGATCGGAAGAGCACACGTCTGAACTCCAGTCACATCACGATCTCGTATGCCGTCTTCTGCTTG"
+ADAPTER_R2 = "AGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGTAGATCTCGGTGGTCGCCGTATCATT"
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+## Fastq files are written by blocks of reads
+BLOCK_READS = 100000
+
+TRIMGALORE_LOG = """SUMMARISING RUN PARAMETERS
+==========================
+Input filename: {input}
+Trimming mode: {mode}
+Trim Galore version: 0.6.7
+Cutadapt version: 3.4
+Quality Phred score cutoff: 20
+Quality encoding type selected: ASCII+33
+Adapter sequence: 'AGATCGGAAGAGC' (Illumina TruSeq, Sanger iPE; auto-detected)
+Maximum trimming error rate: 0.1 (default)
+Minimum required adapter overlap (stringency): 1 bp
+Minimum required sequence length before a sequence gets removed: 10 bp
+
+This is cutadapt 3.4 with Python 3.9.5
+Command line parameters: -j 4 -e 0.1 -q 20 -O 1 -a AGATCGGAAGAGC {input}
+Processing reads on 4 cores in single-end mode ...
+
+=== Summary ===
+
+Total reads processed:            {reads:>12,}
+Reads with adapters:              {adapters:>12,} ({adapters_pct:.1f}%)
+Reads written (passing filters):  {reads:>12,} (100.0%)
+
+Total basepairs processed: {bases:>12,} bp
+Quality-trimmed:           {qual:>12,} bp ({qual_pct:.1f}%)
+Total written (filtered):  {written:>12,} bp ({written_pct:.1f}%)
+
+=== Adapter 1 ===
+
+Sequence: AGATCGGAAGAGC; Type: regular 3'; Length: 13; Trimmed: {adapters} times
+
+RUN STATISTICS FOR INPUT FILE: {input}
+=============================================
+{reads} sequences processed in total
+{removed}"""
+
+TRIMGALORE_REMOVED_SE = "Sequences removed because they became shorter than the length cutoff of 10 bp:\t{short} ({short_pct:.3f}%)\n"
+TRIMGALORE_REMOVED_PE = "Number of sequence pairs removed because at least one read was shorter than the length cutoff (10 bp): {short} ({short_pct:.2f}%)\n"
+
+CUTADAPT_LOG = """This is cutadapt 3.4 with Python 3.9.5
+Command line parameters: --cores=4 -a A{{20}} -m 10 -o out.fastq.gz in.fastq.gz
+Processing reads on 4 cores in single-end mode ...
+
+=== Summary ===
+
+Total reads processed:             {reads:>12,}
+Reads with adapters:               {adapters:>12,} ({adapters_pct:.1f}%)
+Reads that were too short:         {short:>12,} ({short_pct:.1f}%)
+Reads written (passing filters):   {reads:>12,} (100.0%)
+
+Total basepairs processed: {bases:>12,} bp
+Total written (filtered):  {written:>12,} bp ({written_pct:.1f}%)
+
+=== Adapter 1 ===
+
+Sequence: AAAAAAAAAAAAAAAAAAAA; Type: regular 3'; Length: 20; Trimmed: {adapters} times
+"""
+
+FASTQC_DATA = """##FastQC\t0.11.9
+>>Basic Statistics\tpass
+#Measure\tValue
+Filename\t{name}
+File type\tConventional base calls
+Encoding\tSanger / Illumina 1.9
+Total Sequences\t{reads}
+Sequences flagged as poor quality\t0
+Sequence length\t10-{length}
+%GC\t50
+>>END_MODULE
+>>Per base sequence quality\tpass
+#Base\tMean\tMedian\tLower Quartile\tUpper Quartile\t10th Percentile\t90th Percentile
+{per_base}>>END_MODULE
+>>Per sequence quality scores\tpass
+#Quality\tCount
+{per_seq}>>END_MODULE
+"""
+
+XENGSORT_LOG = "# xengsort classify\nprefix\thost\tgraft\tambiguous\tboth\tneither\n{sample}\t{host}\t{graft}\t{ambiguous}\t0\t{neither}\n"
+
+
+def get_options():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--outdir", default="benchmark_data", help="Output directory")
+    parser.add_argument("-n", "--samples", type=int, default=10, help="Number of samples (logs and statistics)")
+    parser.add_argument("-f", "--fastq_samples", type=int, default=2, help="Number of samples with fastq files")
+    parser.add_argument("-r", "--reads", type=int, default=100000, help="Number of reads per fastq file")
+    parser.add_argument("-l", "--length", type=int, default=100, help="Read length")
+    parser.add_argument("--pe", action="store_true", help="Paired-end data")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+    return(args)
+
+
+def sample_names(n):
+    return ["S{:05d}".format(i + 1) for i in range(n)]
+
+
+def write_fastq(path, rng, n_reads, length, adapter, name, trimmed_path=None, min_len=10):
+    """
+    Write random reads, with an adapter read-through after a random insert size.
+    The trimmed reads (adapter removed, short reads dropped) are written to trimmed_path.
+    """
+    adapter = np.frombuffer(adapter.encode('ascii'), dtype=np.uint8)
+    quals = np.frombuffer(b"#+5?FIJ", dtype=np.uint8)
+    with gzip.open(path, 'wb', compresslevel=1) as out, \
+            (gzip.open(trimmed_path, 'wb', compresslevel=1) if trimmed_path else open(os.devnull, 'wb')) as trim:
+        for start in range(0, n_reads, BLOCK_READS):
+            n = min(BLOCK_READS, n_reads - start)
+            seqs = BASES[rng.randint(0, 4, size=(n, length))]
+            inserts = rng.randint(length // 3, 4 * length, size=n)
+            for i in np.flatnonzero(inserts < length):
+                end = min(length, inserts[i] + adapter.size)
+                seqs[i, inserts[i]:end] = adapter[:end - inserts[i]]
+            qual = quals[np.minimum(rng.geometric(0.3, size=(n, length)), quals.size) - 1][:, ::-1]
+            lengths = np.minimum(inserts, length)
+            records = []
+            trimmed = []
+            for i in range(n):
+                header = "@{}.{} {}\n".format(name, start + i, i % 2 + 1).encode('ascii')
+                seq = seqs[i].tobytes()
+                qv = qual[i].tobytes()
+                records.append(header + seq + b"\n+\n" + qv + b"\n")
+                if lengths[i] >= min_len:
+                    trimmed.append(header + seq[:lengths[i]] + b"\n+\n" + qv[:lengths[i]] + b"\n")
+            out.write(b"".join(records))
+            trim.write(b"".join(trimmed))
+
+
+def log_values(rng, n_reads, length):
+    adapters = int(n_reads * rng.uniform(0.05, 0.6))
+    short = int(n_reads * rng.uniform(0., 0.05))
+    bases = n_reads * length
+    qual = int(bases * rng.uniform(0., 0.02))
+    written = bases - qual - adapters * length // 3
+    return dict(reads=n_reads, adapters=adapters, adapters_pct=100. * adapters / n_reads,
+                short=short, short_pct=100. * short / n_reads, bases=bases, qual=qual,
+                qual_pct=100. * qual / bases, written=written, written_pct=100. * written / bases)
+
+
+def write_fastp_json(path, rng, n_reads, length, pe):
+    values = log_values(rng, n_reads, length)
+    report = {
+        "summary": {
+            "fastp_version": "0.23.2",
+            "sequencing": "paired end ({0} cycles + {0} cycles)".format(length) if pe else "single end ({} cycles)".format(length),
+            "before_filtering": {"total_reads": n_reads * (2 if pe else 1), "total_bases": values["bases"]},
+            "after_filtering": {"total_reads": n_reads - values["short"]}
+        },
+        "filtering_result": {"passed_filter_reads": n_reads - values["short"], "low_quality_reads": values["qual"] // length,
+                             "too_many_N_reads": 0, "too_short_reads": values["short"]},
+        "duplication": {"rate": rng.uniform(0., 0.3)},
+        "adapter_cutting": {"adapter_trimmed_reads": values["adapters"], "adapter_trimmed_bases": values["adapters"] * length // 3,
+                            "read1_adapter_sequence": ADAPTER_R1[:33]},
+        "polyx_trimming": {"total_polyx_trimmed_reads": values["short"] // 2},
+        ## per cycle curves, as in real reports, which are skipped by the parser
+        "read1_before_filtering": {"total_reads": n_reads,
+                                   "quality_curves": dict((b, list(rng.uniform(20, 40, length).round(1))) for b in "ACGT"),
+                                   "kmer_count": dict(("".join(k), int(c)) for k, c in zip(
+                                       np.array(list("ACGT"))[rng.randint(0, 4, (1024, 5))], rng.randint(0, 1000, 1024)))}
+    }
+    if pe:
+        report["adapter_cutting"]["read2_adapter_sequence"] = ADAPTER_R2[:33]
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+
+
+def write_trimgalore_logs(prefix, rng, n_reads, length, pe):
+    logs = []
+    for read in ([1, 2] if pe else [None]):
+        values = log_values(rng, n_reads, length)
+        name = "{}_adapter3p{}.fastq.gz".format(os.path.basename(prefix), "_{}".format(read) if read else "")
+        removed = ""
+        if read is None:
+            removed = TRIMGALORE_REMOVED_SE.format(**values)
+        elif read == 2:
+            removed = TRIMGALORE_REMOVED_PE.format(**values)
+        path = os.path.join(os.path.dirname(prefix), name + "_trimming_report.txt")
+        with open(path, 'w') as f:
+            f.write(TRIMGALORE_LOG.format(input=name, mode="paired-end" if pe else "single-end", removed=removed, **values))
+        logs.append(path)
+    return logs
+
+
+def write_stats(path, sample, rng, n_reads, length, pe):
+    """
+    General metrics (fastq_metrics.py output) and per sequence quality files
+    """
+    trimmed = int(n_reads * rng.uniform(0.05, 0.6))
+    discarded = int(n_reads * rng.uniform(0., 0.05))
+    with open(os.path.join(path, "{}_stats.trim.csv".format(sample)), 'w') as f:
+        f.write("Sample_id,Number_of_frag,Mean_length,Total_base,Trimmed_Mean_length,Number_trimmed,Percent_trimmed,Number_discarded,Percent_discarded\n")
+        f.write("{},{},{},{},{},{},{:.2f},{},{:.2f}\n".format(
+            sample, n_reads, length, n_reads * length * (2 if pe else 1), length - 10, trimmed,
+            100. * trimmed / n_reads, discarded, 100. * discarded / n_reads))
+    for suffix in (["_R1", "_R2"] if pe else [""]):
+        counts = rng.multinomial(n_reads, np.ones(41) / 41)
+        with open(os.path.join(path, "{}{}_seqqual.tsv".format(sample, suffix)), 'w') as f:
+            f.write("".join("{}\t{}\n".format(q, c) for q, c in enumerate(counts) if c))
+
+
+def write_fastqc(path, sample, rng, n_reads, length, pe):
+    """
+    FastQC zip files of the trimmed reads (only the modules read by stats2multiqc.py and MultiQC)
+    """
+    for suffix in (["_1", "_2"] if pe else [""]):
+        name = "{}{}".format(sample, suffix)
+        counts = rng.multinomial(n_reads, np.ones(41) / 41)
+        per_base = "".join("{0}\t{1:.1f}\t{1:.1f}\t{1:.1f}\t{1:.1f}\t{1:.1f}\t{1:.1f}\n".format(i + 1, rng.uniform(20, 40))
+                           for i in range(length))
+        per_seq = "".join("{}\t{:.1f}\n".format(q, c) for q, c in enumerate(counts) if c)
+        data = FASTQC_DATA.format(name=name, reads=n_reads, length=length, per_base=per_base, per_seq=per_seq)
+        with zipfile.ZipFile(os.path.join(path, "{}_fastqc.zip".format(name)), 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr("{}_fastqc/fastqc_data.txt".format(name), data)
+
+
+def generate(outdir, n_samples, fastq_samples, n_reads, length, pe, seed=1):
+    """
+    Generate the dataset, and return its description
+    """
+    rng = np.random.RandomState(seed)
+    dirs = dict((d, os.path.join(outdir, d)) for d in ("fastq", "logs", "stats", "xengsort", "fastqc"))
+    for d in dirs.values():
+        os.makedirs(d, exist_ok=True)
+    samples = sample_names(n_samples)
+    fastq = []
+    manifest = []
+    with open(os.path.join(outdir, "samplePlan.csv"), 'w') as splan:
+        for i, sample in enumerate(samples):
+            reads = [os.path.join(dirs["fastq"], "{}{}.fastq.gz".format(sample, suffix)) for suffix in (["_R1", "_R2"] if pe else [""])]
+            splan.write(",".join([sample, "sample_{}".format(i + 1)] + reads) + "\n")
+            if i < fastq_samples:
+                trims = [r.replace(".fastq.gz", "_trimmed.fastq.gz") for r in reads]
+                for read, trim, adapter in zip(reads, trims, [ADAPTER_R1, ADAPTER_R2]):
+                    write_fastq(read, rng, n_reads, length, adapter, sample, trimmed_path=trim)
+                fastq.append(dict(sample=sample, reads=reads, trimmed=trims))
+
+            tg_logs = write_trimgalore_logs(os.path.join(dirs["logs"], sample), rng, n_reads, length, pe)
+            manifest.append([sample, "trimgalore", "3-prime adapter", "{}_adapter3p".format(sample), ",".join(tg_logs)])
+            ca_log = os.path.join(dirs["logs"], "{}_polyA.log".format(sample))
+            with open(ca_log, 'w') as f:
+                f.write(CUTADAPT_LOG.format(**log_values(rng, n_reads, length)))
+            manifest.append([sample, "cutadapt", "3-prime polyA", "{}_polyA".format(sample), ca_log])
+            fp_json = os.path.join(dirs["logs"], "{}.fastp.json".format(sample))
+            write_fastp_json(fp_json, rng, n_reads, length, pe)
+            manifest.append([sample, "fastp", "3-prime adapters", "{}_adapter".format(sample), fp_json])
+
+            n_host = int(n_reads * rng.uniform(0, 0.5))
+            with open(os.path.join(dirs["xengsort"], "{}_xengsort.log".format(sample)), 'w') as f:
+                f.write(XENGSORT_LOG.format(sample=sample, host=n_host, graft=n_reads - n_host - 10, ambiguous=5, neither=5))
+            write_stats(dirs["stats"], sample, rng, n_reads, length, pe)
+            if i % 2 == 0:
+                write_fastqc(dirs["fastqc"], sample, rng, n_reads, length, pe)
+
+    with open(os.path.join(outdir, "trimmingManifest.tsv"), 'w') as f:
+        for row in manifest:
+            f.write("\t".join(row) + "\n")
+
+    return dict(samples=n_samples, fastq_samples=len(fastq), reads=n_reads, length=length, pe=pe,
+                fastq=fastq, splan=os.path.join(outdir, "samplePlan.csv"), manifest=os.path.join(outdir, "trimmingManifest.tsv"),
+                dirs=dirs)
+
+
+if __name__ == '__main__':
+    args = get_options()
+    dataset = generate(args.outdir, args.samples, args.fastq_samples, args.reads, args.length, args.pe, seed=args.seed)
+    print(json.dumps(dataset, indent=2))
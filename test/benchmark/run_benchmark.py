@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+
+#############################################################################################
+# Copyright Institut Curie 2022                                                             #
+#                                                                                           #
+# This software is a computer program whose purpose                                         #
+# is to analyze high-throughput sequencing data.                                            #
+# You can use, modify and/ or redistribute the software under                               #
+# the terms of license (see the LICENSE file for more details).                             #
+# The software is distributed in the hope that it will be useful,                           #
+# but "AS IS" WITHOUT ANY WARRANTY OF ANY KIND.                                             #
+# Users are therefore encouraged to test the software's suitabilityas regards               #
+# their requirements in conditions enabling the security of their systems and/or data.      #
+# The fact that you are presently reading this means that                                   #
+# you have had knowledge of the license and that you accept its terms.                      #
+#############################################################################################
+
+"""
+Benchmark the python scripts of the pipeline on a synthetic dataset (see generate_data.py).
+Each step is run as a separate process; its wall time, CPU time and peak resident memory
+(from wait4, the error output being written in a temporary file) are recorded with its throughput in a JSON file. The dataset is also generated
+in a separate process, so that the peak memory of the steps (inherited at fork) does not
+include the memory of this script.
+With --baseline, the results are compared with a previous run, and the script fails if
+a step is slower (or uses more memory) than the baseline by more than --tolerance.
+
+Example:
+  run_benchmark.py --samples 1000 --reads 200000 --pe -o baseline.json
+  run_benchmark.py --samples 1000 --reads 200000 --pe --baseline baseline.json -o current.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from collections import OrderedDict
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+BIN_DIR = os.path.join(BENCHMARK_DIR, "..", "..", "bin")
+MB = 1024. * 1024.
+
+
+def get_options():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--samples", type=int, default=10, help="Number of samples (10 to 10,000)")
+    parser.add_argument("-f", "--fastq_samples", type=int, default=2, help="Number of samples with fastq files for the metrics step")
+    parser.add_argument("-r", "--reads", type=int, default=100000, help="Number of reads per fastq file")
+    parser.add_argument("-l", "--length", type=int, default=100, help="Read length")
+    parser.add_argument("--pe", action="store_true", help="Paired-end data")
+    parser.add_argument("-p", "--threads", type=int, default=1, help="Number of threads given to the scripts")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of runs of each step, the fastest one is kept")
+    parser.add_argument("-d", "--data_dir", default=None, help="Directory of the dataset (default: temporary directory, removed at the end)")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="Output JSON file")
+    parser.add_argument("-b", "--baseline", default=None, help="Baseline JSON file to compare with")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.2, help="Maximum relative increase of time and memory versus the baseline")
+    parser.add_argument("--steps", default=None, help="Comma-separated list of steps to run (default: all)")
+    args = parser.parse_args()
+    return(args)
+
+
+def file_size(paths):
+    return sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+
+def run_step(cmd, cwd, repeat=1):
+    """
+    Run a command, and return its wall time, CPU time (user + system) and peak RSS (MB).
+    The fastest of 'repeat' runs is kept.
+    """
+    best = None
+    for _ in range(max(repeat, 1)):
+        start = time.time()
+        ## not a pipe, which would block the step once full, as it is only read at the end
+        with open(os.devnull, 'wb') as devnull, tempfile.TemporaryFile() as stderr:
+            proc = subprocess.Popen(cmd, cwd=cwd, stdout=devnull, stderr=stderr)
+            ## rusage of this child only (ru_maxrss is in kB on Linux)
+            pid, status, usage = os.wait4(proc.pid, 0)
+            seconds = time.time() - start
+            stderr.seek(0)
+            err = stderr.read().decode('utf-8', 'replace')
+        if status != 0:
+            raise RuntimeError("{} failed:\n{}".format(" ".join(cmd), err))
+        run = OrderedDict([("seconds", round(seconds, 3)),
+                           ("cpu_seconds", round(usage.ru_utime + usage.ru_stime, 3)),
+                           ("peak_rss_mb", round(usage.ru_maxrss / 1024., 1))])
+        if best is None or run["seconds"] < best["seconds"]:
+            best = run
+    return best
+
+
+def get_steps(dataset, threads):
+    """
+    Steps to benchmark, as an ordered dict {name: (command, reads, bytes)}
+    """
+    python = sys.executable
+    script = lambda name: os.path.join(BIN_DIR, name)
+    dirs = dataset["dirs"]
+    steps = OrderedDict()
+
+    ## general metrics, on the samples with fastq files
+    fastq = dataset["fastq"]
+    if fastq:
+        sample = fastq[0]
+        inputs = ["-i", sample["reads"][0], "-t", sample["trimmed"][0]]
+        if len(sample["reads"]) > 1:
+            inputs += ["-I", sample["reads"][1], "-T", sample["trimmed"][1]]
+        n_reads = dataset["reads"] * len(sample["reads"]) * 2
+        size = file_size(sample["reads"] + sample["trimmed"])
+        steps["fastq_metrics"] = ([python, script("fastq_metrics.py")] + inputs + ["-s", sample["sample"], "-p", str(threads)],
+                                  n_reads, size)
+        steps["fastq_metrics_qc"] = ([python, script("fastq_metrics.py")] + inputs + ["-s", sample["sample"], "-p", str(threads),
+                                                                                      "--qc", "--complexity", "--seqqual"],
+                                     n_reads, size)
+
+    ## trimming reports, all samples in batch mode
+    logs = [log for line in open(dataset["manifest"]) for log in line.rstrip('\n').split('\t')[4].split(',')]
+    steps["trimming_report"] = ([python, script("trimming_report.py"), "--manifest", dataset["manifest"], "--combined", "-o", "all"],
+                                None, file_size(logs))
+
+    ## MultiQC table and header
+    stats = [os.path.join(dirs[d], f) for d in ("stats", "fastqc") for f in os.listdir(dirs[d])]
+    xlogs = [os.path.join(dirs["xengsort"], f) for f in os.listdir(dirs["xengsort"])]
+    steps["stats2multiqc"] = ([python, script("stats2multiqc.py"), dataset["splan"], "1" if dataset["pe"] else "0",
+                               "-s", dirs["stats"], "-x", dirs["xengsort"], "-f", dirs["fastqc"],
+                               "-p", str(threads), "-o", "mq.stats"],
+                              None, file_size(stats + xlogs))
+    steps["mqc_header"] = ([python, script("mqc_header.py"), "--name", "Raw-QC", "--version", "benchmark", "--splan", dataset["splan"]],
+                           None, file_size([dataset["splan"]]))
+    return steps
+
+
+def compare(results, baseline, tolerance):
+    """
+    Steps slower or using more memory than the baseline, as a list of messages
+    """
+    regressions = []
+    for name, res in results.items():
+        ref = baseline.get("steps", {}).get(name)
+        if ref is None:
+            continue
+        for key in ("seconds", "peak_rss_mb"):
+            if ref.get(key) and res[key] > ref[key] * (1. + tolerance):
+                regressions.append("{}: {} {} -> {} (+{:.0f}%)".format(name, key, ref[key], res[key], 100. * (res[key] / ref[key] - 1.)))
+    return regressions
+
+
+def main(args):
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="rawqc_benchmark_")
+    try:
+        start = time.time()
+        cmd = [sys.executable, os.path.join(BENCHMARK_DIR, "generate_data.py"), "-o", data_dir, "-n", str(args.samples),
+               "-f", str(min(args.fastq_samples, args.samples)), "-r", str(args.reads), "-l", str(args.length)]
+        dataset = json.loads(subprocess.check_output(cmd + (["--pe"] if args.pe else [])).decode('utf-8'))
+        sys.stderr.write("Dataset generated in {:.1f}s ({})\n".format(time.time() - start, data_dir))
+
+        workdir = os.path.join(data_dir, "run")
+        os.makedirs(workdir, exist_ok=True)
+        steps = get_steps(dataset, args.threads)
+        if args.steps:
+            selected = args.steps.split(',')
+            steps = OrderedDict((name, step) for name, step in steps.items() if name in selected)
+
+        results = OrderedDict()
+        for name, (cmd, n_reads, size) in steps.items():
+            res = run_step(cmd, workdir, repeat=args.repeat)
+            res["samples"] = args.samples
+            res["samples_per_s"] = round(args.samples / res["seconds"], 1) if name not in ("fastq_metrics", "fastq_metrics_qc") else None
+            res["reads_per_s"] = round(n_reads / res["seconds"]) if n_reads else None
+            res["mb_per_s"] = round(size / MB / res["seconds"], 2)
+            results[name] = res
+            sys.stderr.write("{:<20} {:>8.2f}s {:>8.1f} MB RSS {:>10} MB/s\n".format(name, res["seconds"], res["peak_rss_mb"], res["mb_per_s"]))
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = OrderedDict([
+        ("date", time.strftime("%Y-%m-%d %H:%M:%S")),
+        ("host", OrderedDict([("node", platform.node()), ("python", platform.python_version()), ("cpus", os.cpu_count())])),
+        ("config", OrderedDict([("samples", args.samples), ("fastq_samples", dataset["fastq_samples"]), ("reads", args.reads),
+                                ("length", args.length), ("pe", args.pe), ("threads", args.threads)])),
+        ("steps", results)
+    ])
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            sys.stderr.write("Warning: the baseline was run with another configuration\n")
+        regressions = compare(results, baseline, args.tolerance)
+        for msg in regressions:
+            sys.stderr.write("REGRESSION {}\n".format(msg))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(get_options()))